@@ -0,0 +1,59 @@
+"""
+Compare the link absolutizer of toolbox.emails with the lxml-based one it
+replaced, on a newsletter-sized HTML email.
+
+Usage: python benchmarks/links.py [number of links]
+"""
+import importlib.util
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+
+settings.configure()
+
+from toolbox.emails import _make_links_absolute
+
+
+def _make_links_absolute_lxml(html, base_url):
+    from lxml.html import fromstring, tostring
+    parsed = fromstring(html)
+
+    parsed.make_links_absolute(base_url)
+
+    return tostring(parsed, encoding='unicode')
+
+
+def make_email(links):
+    item = (
+        '<tr><td><img src="/static/img/%(i)d.png" alt="">'
+        '<a href="/articles/%(i)d/?utm_source=newsletter">Article %(i)d</a>'
+        '<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p></td></tr>'
+    )
+    rows = ''.join(item % {'i': i} for i in range(links // 2))
+    return '<html><body><table>%s</table></body></html>' % rows
+
+
+def main():
+    links = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    html = make_email(links)
+    base_url = 'https://example.com'
+    number = 200
+
+    implementations = [('regex', _make_links_absolute)]
+    if importlib.util.find_spec('lxml') is None:
+        print("lxml isn't installed, skipping the lxml implementation.")
+    else:
+        implementations.append(('lxml', _make_links_absolute_lxml))
+
+    print("%d links, %d bytes of HTML, %d runs" % (links, len(html), number))
+    for name, function in implementations:
+        duration = timeit.timeit(lambda: function(html, base_url), number=number)
+        print("%-6s %8.3f ms per email" % (name, duration / number * 1000))
+
+
+if __name__ == '__main__':
+    main()
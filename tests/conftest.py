@@ -0,0 +1,41 @@
+import django
+from django.conf import settings
+
+
+TEMPLATES = {
+    'mail/base.html': '<p><a href="/base">Base</a>{% block content %}{% endblock %}</p>',
+    'mail/child.html': (
+        '{% extends "./base.html" %}'
+        '{% block content %}<a href="/child">Child</a>{% endblock %}'
+    ),
+}
+
+
+def pytest_configure():
+    settings.configure(
+        INSTALLED_APPS=[
+            'django.contrib.contenttypes',
+            'django.contrib.sites',
+        ],
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': ':memory:',
+            },
+        },
+        TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'OPTIONS': {
+                'libraries': {'claude': 'toolbox.templatetags.claude'},
+                'loaders': [
+                    ('django.template.loaders.locmem.Loader', TEMPLATES),
+                ],
+            },
+        }],
+        EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+        SITE_ID=1,
+    )
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
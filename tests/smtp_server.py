@@ -0,0 +1,109 @@
+import asyncio
+import threading
+
+
+class SMTPServer(object):
+    """
+    A minimal SMTP server for the tests, running an asyncio event loop in a
+    thread of the test process.
+
+    Accepted messages are stored in messages as (sender, recipients, data)
+    tuples. Recipients starting with "refused" are refused, and each DATA
+    command takes delay seconds. sessions counts the connections and peak is
+    the highest number of messages received at once.
+    """
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.messages = []
+        self.sessions = 0
+        self.active = 0
+        self.peak = 0
+        self._writers = set()
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self.handle, '127.0.0.1', 0))
+            self.port = self.server.sockets[0].getsockname()[1]
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run)
+        self.thread.daemon = True
+        self.thread.start()
+        started.wait()
+        return self.port
+
+    def stop(self):
+        self.drop_connections()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.server.close()
+        self.loop.close()
+
+    def drop_connections(self):
+        """Close the open connections, like a server timing them out."""
+        def drop():
+            for writer in list(self._writers):
+                writer.close()
+        self.loop.call_soon_threadsafe(drop)
+
+    async def handle(self, reader, writer):
+        self.sessions += 1
+        self._writers.add(writer)
+        sender, recipients = None, []
+
+        def reply(line):
+            writer.write(line.encode('ascii') + b'\r\n')
+
+        try:
+            reply('220 stand-in ESMTP')
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line[:4].upper()
+                argument = line[5:].strip().decode('ascii')
+                if command in (b'EHLO', b'HELO'):
+                    reply('250 stand-in')
+                elif command == b'MAIL':
+                    sender, recipients = argument.split(':', 1)[1].strip('<>'), []
+                    reply('250 OK')
+                elif command == b'RCPT':
+                    recipient = argument.split(':', 1)[1].strip('<>')
+                    if recipient.startswith('refused'):
+                        reply('550 Refused')
+                    else:
+                        recipients.append(recipient)
+                        reply('250 OK')
+                elif command == b'DATA':
+                    reply('354 Go ahead')
+                    await writer.drain()
+                    data = []
+                    line = await reader.readline()
+                    while line not in (b'.\r\n', b''):
+                        data.append(line)
+                        line = await reader.readline()
+                    self.active += 1
+                    self.peak = max(self.peak, self.active)
+                    await asyncio.sleep(self.delay)
+                    self.active -= 1
+                    self.messages.append((sender, recipients, b''.join(data)))
+                    reply('250 Queued')
+                elif command in (b'RSET', b'NOOP'):
+                    reply('250 OK')
+                elif command == b'QUIT':
+                    reply('221 Bye')
+                    await writer.drain()
+                    break
+                else:
+                    reply('502 Not implemented')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
@@ -0,0 +1,496 @@
+from collections import namedtuple
+from decimal import Decimal
+import os
+import tempfile
+import unittest
+
+from toolbox.claude import (
+    ArrayDataPointsCloud, Axis, CompactDataPointsCloud, DataPointsCloud, numpy,
+)
+
+Sale = namedtuple('Sale', 'region month amount')
+
+SALES = [
+    Sale('EU', 1, Decimal('1.5')),
+    Sale('EU', 2, Decimal('1.5')),
+    Sale('US', 1, Decimal('2')),
+]
+
+
+def add_amount(row, current):
+    return current + row.amount
+
+
+def make_axes():
+    return [Axis('region'), Axis('month')]
+
+
+def quarter(month):
+    return (month - 1) // 3 + 1
+
+
+class LevelsTests(unittest.TestCase):
+    cloud_class = DataPointsCloud
+
+    def setUp(self):
+        axes = [Axis('region'), Axis('month', levels=[('quarter', quarter)])]
+        self.cloud = self.cloud_class(axes, 0)
+        self.cloud.load_data([Sale(region, month, month)
+                              for region in ('EU', 'US') for month in range(1, 7)],
+                             lambda row, current: current + row.amount)
+
+    def test_level_filters(self):
+        self.assertEqual(self.cloud.sum_(quarter=1), 12)
+        self.assertEqual(self.cloud.sum_(quarter=2, region='EU'), 15)
+        self.assertEqual(sorted(self.cloud.points_at(quarter=2)),
+                         [(('EU', 2), 15), (('US', 2), 15)])
+        self.assertEqual(sorted(self.cloud.values_at(quarter__gte=1, region='US')), [6, 15])
+
+    def test_base_and_level_filters(self):
+        with self.assertRaises(ValueError):
+            self.cloud.sum_(month__gte=2, quarter=1)
+        with self.assertRaises(ValueError):
+            self.cloud.points_at(quarter=1, month=2)
+
+    def test_unknown_axis(self):
+        with self.assertRaises(ValueError):
+            self.cloud.points_at(week=1)
+
+
+class CompactLevelsTests(LevelsTests):
+    cloud_class = CompactDataPointsCloud
+
+
+@unittest.skipIf(numpy is None, "numpy isn't installed")
+class ArrayLevelsTests(LevelsTests):
+    cloud_class = ArrayDataPointsCloud
+
+
+class MarginalsTests(unittest.TestCase):
+    def setUp(self):
+        self.cloud = DataPointsCloud(make_axes(), 0, marginals=[('region',), ('month',), ()])
+        self.cloud.load_data(SALES, add_amount)
+
+    def test_totals(self):
+        self.assertEqual(self.cloud.sum_(region='EU'), Decimal('3'))
+        self.assertEqual(self.cloud.sum_(region='AS'), 0)
+        self.assertEqual(self.cloud.sum_(month=1), Decimal('3.5'))
+        self.assertEqual(self.cloud.sum_(), Decimal('5'))
+        self.assertEqual(self.cloud._marginal_total({'region': 'US'}), Decimal('2'))
+        # Not materialized: answered from the points.
+        self.assertIsNone(self.cloud._marginal_total({'region': 'EU', 'month': 1}))
+        self.assertEqual(self.cloud.sum_(region='EU', month=1), Decimal('1.5'))
+
+    def test_upkeep(self):
+        self.cloud.load_data([Sale('EU', 1, Decimal('1'))], add_amount)
+        self.cloud.remove_points(month=2)
+        self.assertEqual(self.cloud.sum_(region='EU'), Decimal('2.5'))
+        self.assertEqual(self.cloud.sum_(month=2), 0)
+        self.assertEqual(self.cloud.sum_(), Decimal('4.5'))
+
+    def test_unknown_axis(self):
+        with self.assertRaises(ValueError):
+            DataPointsCloud(make_axes(), 0, marginals=[('region',), ('week',)])
+
+
+@unittest.skipIf(numpy is None, "numpy isn't installed")
+class ArrayDataPointsCloudTests(unittest.TestCase):
+    def test_int_default_doesnt_truncate(self):
+        cloud = ArrayDataPointsCloud(make_axes(), int)
+        cloud.load_data(SALES, add_amount)
+        self.assertEqual(cloud.sum_(region='EU'), 3)
+        self.assertEqual(cloud.value_at(region='US', month=1), 2)
+
+    def test_decimal_values_stay_exact(self):
+        cloud = ArrayDataPointsCloud(make_axes(), Decimal)
+        cloud.load_data(SALES, add_amount)
+        self.assertEqual(cloud.sum_(), Decimal('5'))
+        self.assertIsInstance(cloud.sum_(), Decimal)
+        self.assertEqual(cloud.values_at(month=1), [Decimal('1.5'), Decimal('2')])
+
+    def test_none_default(self):
+        cloud = ArrayDataPointsCloud(make_axes())
+        cloud.load_data(SALES)
+        self.assertEqual(cloud.value_at(region='EU', month=2), SALES[1])
+        self.assertEqual(cloud.value_at(region='US', month=2), None)
+        self.assertEqual(sorted(cloud.points_at(month=1)),
+                         [(('EU', 1), SALES[0]), (('US', 1), SALES[2])])
+
+    def test_int_default_keeps_ints(self):
+        cloud = ArrayDataPointsCloud(make_axes(), 0)
+        cloud.load_data(SALES, add_amount_to_int)
+        self.assertEqual(cloud.sum_(region='EU'), 2)
+        self.assertIsInstance(cloud.sum_(region='EU'), int)
+        self.assertIsInstance(cloud.value_at(region='EU', month=1), int)
+        # A float converts the array instead of being truncated.
+        cloud.load_data([Sale('US', 2, 0.5)], add_amount)
+        self.assertEqual(cloud.sum_(region='US'), 2.5)
+        self.assertIsInstance(cloud.value_at(region='EU', month=1), int)
+
+    def test_explicit_dtype(self):
+        cloud = ArrayDataPointsCloud(make_axes(), int, dtype=int)
+        cloud.load_data(SALES, lambda row, current: current + int(row.amount))
+        self.assertEqual(cloud.sum_(), 4)
+        self.assertIsInstance(cloud.sum_(), int)
+
+    def test_grow_and_remove(self):
+        cloud = ArrayDataPointsCloud(make_axes(), Decimal, marginals=[('region',)])
+        cloud.load_data(SALES, add_amount)
+        cloud.load_data([Sale('AS', month, Decimal(1)) for month in range(3, 10)], add_amount)
+        self.assertEqual(cloud.sum_(region='AS'), 7)
+        self.assertEqual(cloud.remove_points(region='EU'), 2)
+        self.assertEqual(cloud.sum_(), 9)
+        self.assertEqual(cloud.sum_(region='EU'), 0)
+
+
+class FromQuerysetTests(unittest.TestCase):
+    def setUp(self):
+        from django.contrib.sites.models import Site
+        
+        Site.objects.bulk_create([
+            Site(id=2, domain='a.example.com', name='A'),
+            Site(id=3, domain='b.example.com', name='A'),
+            Site(id=4, domain='c.example.com', name='B'),
+        ])
+        self.sites = Site.objects.filter(id__gt=1)
+
+    def tearDown(self):
+        self.sites.delete()
+
+    def make_axes(self):
+        # An axis without a field: rows are aggregated in Python.
+        return [Axis('letter', projection=lambda site: site.name)]
+
+    def test_python_count(self):
+        from django.db.models import Count
+        
+        cloud = DataPointsCloud.from_queryset(self.sites, self.make_axes(), Count('id'))
+        self.assertEqual(sorted(cloud.points()), [(('A',), 2), (('B',), 1)])
+
+    def test_python_sum(self):
+        from django.db.models import Sum
+        
+        cloud = DataPointsCloud.from_queryset(self.sites, self.make_axes(), Sum('id'))
+        self.assertEqual(sorted(cloud.points()), [(('A',), 5), (('B',), 4)])
+
+    def test_python_other_aggregate(self):
+        from django.db.models import Count, Max
+        
+        with self.assertRaises(ValueError):
+            DataPointsCloud.from_queryset(self.sites, self.make_axes(), Max('id'))
+        with self.assertRaises(ValueError):
+            DataPointsCloud.from_queryset(self.sites, self.make_axes(),
+                                          Count('name', distinct=True))
+
+    def test_pushed_down_count(self):
+        from django.db.models import Count
+        
+        cloud = DataPointsCloud.from_queryset(self.sites, [Axis('name', field='name')],
+                                              Count('id'))
+        self.assertEqual(sorted(cloud.points()), [(('A',), 2), (('B',), 1)])
+
+    def test_load_queryset(self):
+        from django.contrib.sites.models import Site
+        
+        rows = []
+        
+        def add_id(row, current):
+            rows.append(row)
+            return current + row.id
+        
+        axes = [Axis('name', field='name'),
+                Axis('tld', projection=lambda row: row.domain.rpartition('.')[2], field='domain')]
+        cloud = DataPointsCloud(axes, 0)
+        cloud.load_queryset(self.sites.order_by('id'), add_id, fields=('id', 'name'))
+        self.assertEqual(sorted(cloud.points()), [(('A', 'com'), 5), (('B', 'com'), 4)])
+        # Only the needed columns are fetched, once each.
+        self.assertNotIsInstance(rows[0], Site)
+        self.assertEqual(rows[0]._fields, ('name', 'domain', 'id'))
+        self.assertEqual(tuple(rows[0]), ('A', 'a.example.com', 2))
+
+    def test_load_queryset_instances(self):
+        from django.contrib.sites.models import Site
+        
+        rows = []
+        
+        def count(row, current):
+            rows.append(row)
+            return current + 1
+        
+        cloud = DataPointsCloud(self.make_axes() + [Axis('name', field='name')], 0)
+        cloud.load_queryset(self.sites, count)
+        self.assertEqual(sorted(cloud.points()), [(('A', 'A'), 2), (('B', 'B'), 1)])
+        self.assertIsInstance(rows[0], Site)
+
+    def test_refresh(self):
+        from django.contrib.sites.models import Site
+        
+        cloud = DataPointsCloud([Axis('name', field='name')], 0)
+        count = lambda row, current: current + 1
+        cloud.refresh(self.sites, 'id', count)
+        self.assertEqual(sorted(cloud.points()), [(('A',), 2), (('B',), 1)])
+        self.assertEqual(cloud.watermark, 4)
+        
+        Site.objects.create(id=5, domain='d.example.com', name='A')
+        cloud.refresh(self.sites, 'id', count)
+        self.assertEqual(sorted(cloud.points()), [(('A',), 3), (('B',), 1)])
+        self.assertEqual(cloud.watermark, 5)
+        
+        cloud.refresh(self.sites, 'id', count)
+        self.assertEqual(sorted(cloud.points()), [(('A',), 3), (('B',), 1)])
+        
+        with self.assertRaises(ValueError):
+            DataPointsCloud(self.make_axes(), 0).refresh(self.sites, 'id', count)
+
+
+class SliceTests(unittest.TestCase):
+    def setUp(self):
+        self.cloud = DataPointsCloud(make_axes(), 0)
+        self.cloud.load_data(SALES, add_amount_to_int)
+
+    def test_remove_points(self):
+        self.assertEqual(self.cloud.remove_points(month=1), 2)
+        self.assertEqual(list(self.cloud.points()), [(('EU', 2), 1)])
+        self.assertEqual(self.cloud.remove_points(month=1), 0)
+
+    def test_replace_slice(self):
+        self.cloud.replace_slice({'region': 'EU'}, [Sale('EU', 3, 4), Sale('EU', 3, 1)],
+                                 add_amount_to_int)
+        self.assertEqual(sorted(self.cloud.points()), [(('EU', 3), 5), (('US', 1), 2)])
+
+    def test_row_outside_of_the_slice(self):
+        points = list(self.cloud.points())
+        with self.assertRaises(ValueError):
+            self.cloud.replace_slice({'region': 'EU'}, [Sale('EU', 3, 4), Sale('US', 3, 1)],
+                                     add_amount_to_int)
+        self.assertEqual(list(self.cloud.points()), points)
+
+
+def add_amount_to_int(row, current):
+    return current + int(row.amount)
+
+
+class LoadDataParallelTests(unittest.TestCase):
+    def test_default_make_point(self):
+        cloud = DataPointsCloud(make_axes())
+        cloud.load_data_parallel(SALES, processes=2, chunk_size=1)
+        self.assertEqual(sorted(cloud.points(), key=repr),
+                         sorted(((sale.region, sale.month), sale) for sale in SALES))
+
+    def test_make_point(self):
+        cloud = DataPointsCloud([Axis('region')], int)
+        cloud.load_data_parallel(SALES, add_amount_to_int, processes=2, chunk_size=1)
+        self.assertEqual(sorted(cloud.points()), [(('EU',), 2), (('US',), 2)])
+
+
+class CompactDataPointsCloudTests(unittest.TestCase):
+    def load(self, values, **kwargs):
+        cloud = CompactDataPointsCloud([Axis('region'), Axis('month')], 0, **kwargs)
+        cloud.load_data([Sale('EU', month, value) for month, value in enumerate(values)],
+                        lambda row, current: current + row.amount)
+        return cloud
+
+    def test_inferred_typecode(self):
+        self.assertEqual(self.load([1, 2]).typecode, 'q')
+        self.assertIsInstance(self.load([1, 2]).sum_(), int)
+        self.assertEqual(self.load([1.5, 2]).typecode, 'd')
+        self.assertEqual(self.load([1.5, 2]).sum_(), 3.5)
+
+    def test_mismatched_values(self):
+        with self.assertRaises(TypeError):
+            self.load([1, 2.5])
+        with self.assertRaises(TypeError):
+            self.load([Decimal('1.5')])
+        self.assertEqual(self.load([1, Decimal('1.5')], typecode='d').sum_(), 2.5)
+
+
+class SnapshotTests(unittest.TestCase):
+    def setUp(self):
+        cloud = DataPointsCloud(make_axes(), 0)
+        cloud.load_data(SALES, add_amount_to_int)
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        cloud.dump(self.path)
+        self.cloud = DataPointsCloud.open(self.path)
+
+    def tearDown(self):
+        self.cloud.close()
+        os.remove(self.path)
+
+    def test_queries(self):
+        self.assertEqual(self.cloud.sum_(region='EU'), 2)
+        self.assertEqual(self.cloud.value_at(region='US', month=1), 2)
+        with self.assertRaises(TypeError):
+            self.cloud.load_data(SALES, add_amount_to_int)
+
+    def test_group_by(self):
+        grouped = self.cloud.group_by('month')
+        self.assertIsInstance(grouped, CompactDataPointsCloud)
+        self.assertEqual(sorted(grouped.points()), [((1,), 3), ((2,), 1)])
+
+
+class ResultCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cloud = DataPointsCloud(make_axes(), 0)
+        self.cloud.load_data(SALES, add_amount_to_int)
+
+    def test_hits_and_misses(self):
+        self.assertEqual(self.cloud.sum_(region='EU'), 2)
+        self.assertEqual(self.cloud.sum_(region='EU'), 2)
+        self.assertEqual(self.cloud.values_at(month__in=[2, 1]), self.cloud.values_at(month__in=[1, 2]))
+        info = self.cloud.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (2, 2, 2))
+
+    def test_list_and_unhashable_filters(self):
+        self.assertEqual(self.cloud.sum_(month__range=[1, 1]), 3)
+        self.assertEqual(self.cloud.sum_(month__range=[1, 1]), 3)
+        self.assertEqual(self.cloud.cache_info().hits, 1)
+        self.assertEqual(self.cloud.values_at(month__in=[[1]]), [])
+
+    def test_invalidation(self):
+        self.assertEqual(self.cloud.sum_(region='EU'), 2)
+        self.cloud.load_data([Sale('EU', 3, 5)], add_amount_to_int)
+        self.assertEqual(self.cloud.sum_(region='EU'), 7)
+        self.cloud.remove_points(month=1)
+        self.assertEqual(self.cloud.sum_(region='EU'), 6)
+        self.assertEqual(self.cloud.cache_info().hits, 0)
+
+    def test_size(self):
+        self.cloud.cache_size = 1
+        self.cloud.sum_(region='EU')
+        self.cloud.sum_(region='US')
+        self.cloud.sum_(region='EU')
+        info = self.cloud.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (0, 3, 1))
+        self.cloud.cache_size = 0
+        self.cloud.sum_(region='EU')
+        self.assertEqual(self.cloud.cache_info().currsize, 1)
+
+
+class IndexTests(unittest.TestCase):
+    def setUp(self):
+        self.cloud = DataPointsCloud(make_axes(), 0)
+        self.rows = [Sale(region, 'customer%d' % i, 1)
+                     for i in range(50) for region in ('EU', 'US')]
+        self.cloud.load_data(self.rows, add_amount_to_int)
+
+    def test_load_order(self):
+        expected = [(('EU', row.month), 1) for row in self.rows if row.region == 'EU']
+        self.assertEqual(self.cloud.points_at(region='EU'), expected)
+        customers = [customer for (region, customer), value in expected]
+        self.assertEqual(self.cloud.points_at(region__in=['EU'], month__in=customers), expected)
+
+    def test_index_upkeep(self):
+        self.cloud.load_data([Sale('AS', 'customer1', 1)], add_amount_to_int)
+        self.assertEqual(self.cloud.points_at(region='AS'), [(('AS', 'customer1'), 1)])
+        self.assertEqual(len(self.cloud.points_at(month='customer1')), 3)
+        
+        self.cloud.remove_points(region='AS')
+        self.cloud.remove_points(month='customer2')
+        self.assertEqual(self.cloud.points_at(region='AS'), [])
+        self.assertEqual(self.cloud.points_at(month='customer2'), [])
+        self.assertEqual(len(self.cloud.points_at(region='EU')), 49)
+        self.assertNotIn('AS', self.cloud._index[0])
+        self.assertNotIn('customer2', self.cloud._index[1])
+        
+        # Reloaded points come last.
+        self.cloud.load_data([Sale('EU', 'customer2', 1)], add_amount_to_int)
+        self.assertEqual(self.cloud.points_at(region='EU')[-1], (('EU', 'customer2'), 1))
+
+
+class RangeLookupTests(unittest.TestCase):
+    def setUp(self):
+        self.cloud = DataPointsCloud(make_axes(), 0)
+        self.cloud.load_data([Sale('EU', month, month) for month in range(2, 12, 2)],
+                             add_amount_to_int)
+
+    def months(self, **filters):
+        return sorted(month for (region, month), value in self.cloud.points_at(**filters))
+
+    def test_lookups(self):
+        self.assertEqual(self.months(month__gt=4), [6, 8, 10])
+        self.assertEqual(self.months(month__gte=4), [4, 6, 8, 10])
+        self.assertEqual(self.months(month__lt=4), [2])
+        self.assertEqual(self.months(month__lte=4), [2, 4])
+        self.assertEqual(self.months(month__range=(3, 8)), [4, 6, 8])
+        self.assertEqual(self.months(month__range=(4, 4)), [4])
+        self.assertEqual(self.months(month__gt=10), [])
+        self.assertEqual(self.months(month__lt=2), [])
+        self.assertEqual(self.months(month__gte=5, region='EU'), [6, 8, 10])
+        self.assertEqual(self.months(month__gte=5, region='US'), [])
+
+    def test_same_as_scan(self):
+        for lookup in ('gt', 'gte', 'lt', 'lte'):
+            for value in range(0, 13):
+                test = self.cloud.available_axis_lookups[lookup]
+                expected = [month for month in range(2, 12, 2) if test(value, month)]
+                self.assertEqual(self.months(**{'month__' + lookup: value}), expected)
+
+    def test_new_coordinates(self):
+        self.assertEqual(self.months(month__gt=8), [10])
+        self.cloud.load_data([Sale('US', 9, 1), Sale('US', 1, 1)], add_amount_to_int)
+        self.assertEqual(self.months(month__gt=8), [9, 10])
+        self.assertEqual(self.months(month__lte=2), [1, 2])
+        self.cloud.remove_points(month=9)
+        self.assertEqual(self.months(month__gt=8), [10])
+
+
+class RankingTests(unittest.TestCase):
+    def setUp(self):
+        self.cloud = DataPointsCloud(make_axes(), 0, marginals=[('region',)])
+        self.cloud.load_data([Sale('EU', 1, 3), Sale('EU', 2, 2), Sale('US', 1, 5),
+                              Sale('AS', 1, 1), Sale('AS', 2, 4), Sale('AF', 2, 1)],
+                             add_amount_to_int)
+
+    def test_top(self):
+        self.assertEqual(self.cloud.top(1, 'month'), [(1, 9)])
+        self.assertEqual(sorted(self.cloud.top(3, 'region')), [('AS', 5), ('EU', 5), ('US', 5)])
+        self.assertEqual(len(self.cloud.top(2, 'region')), 2)
+        self.assertEqual(len(self.cloud.top(10, 'region')), 4)
+        self.assertEqual(self.cloud.top(1, 'region', month=2), [('AS', 4)])
+        self.assertEqual(self.cloud.top(5, 'month', region__in=['EU', 'US']), [(1, 8), (2, 2)])
+
+    def test_ranked(self):
+        self.assertEqual(self.cloud.ranked('region', month=2),
+                         [(1, 'AS', 4), (2, 'EU', 2), (3, 'AF', 1)])
+        ranked = self.cloud.ranked('region')
+        self.assertEqual([(rank, total) for rank, region, total in ranked],
+                         [(1, 5), (1, 5), (1, 5), (4, 1)])
+        self.assertEqual(ranked[-1][1], 'AF')
+
+    def test_marginals(self):
+        def fail(filters):
+            raise AssertionError("The points were scanned.")
+        self.cloud._points_at = fail
+        self.assertEqual(self.cloud.ranked('region')[-1], (4, 'AF', 1))
+        self.assertEqual(len(self.cloud.top(2, 'region')), 2)
+        with self.assertRaises(AssertionError):
+            self.cloud.top(2, 'month')
+
+
+class SharedAxesTests(unittest.TestCase):
+    def test_vocabularies_arent_shared(self):
+        axes = [Axis(name) for name in 'abcdefg']
+        Row = namedtuple('Row', 'a b c d e f g')
+        first = CompactDataPointsCloud(axes, 0)
+        first.load_data([Row(*([i] * 7)) for i in range(400)], lambda row, current: 1)
+        second = CompactDataPointsCloud(axes, 0)
+        second.load_data([Row(*([-i] * 7)) for i in range(200)], lambda row, current: 1)
+        self.assertEqual(len(second.points()), 200)
+        self.assertEqual(first.sum_(a__gte=0), 400)
+
+    def test_widening_keeps_points(self):
+        cloud = CompactDataPointsCloud([Axis('region'), Axis('month')], 0)
+        rows = [Sale(region, month, 1) for month in range(100) for region in ('EU', 'US', 'AS')]
+        cloud.load_data(rows[:5], add_amount_to_int)
+        cloud._flush()
+        cloud.load_data(rows[5:], add_amount_to_int)
+        self.assertEqual(cloud.sum_(region='US'), 100)
+        self.assertEqual(cloud.sum_(month__range=(10, 19)), 30)
+        self.assertEqual(sorted(cloud.points())[:2], [(('AS', 0), 1), (('AS', 1), 1)])
+
+    def test_too_many_coordinates(self):
+        cloud = CompactDataPointsCloud([Axis('region')], 0)
+        cloud._widths = [62]
+        with self.assertRaises(ValueError):
+            cloud._widen([64])
@@ -0,0 +1,284 @@
+import asyncio
+import base64
+from email import message_from_bytes
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import unittest
+
+from django.conf import settings
+from django.test import RequestFactory, override_settings
+from django.utils.safestring import mark_safe
+
+from toolbox.emails import EmailTemplate, HtmlEmailTemplate, _make_links_absolute
+
+from smtp_server import SMTPServer
+
+try:
+    import aiosmtplib
+except ImportError:
+    aiosmtplib = None
+
+
+class Link(object):
+    html = mark_safe('<a href="/nested">Nested</a>')
+
+
+class LinksTemplate(HtmlEmailTemplate):
+    subject = 'Links'
+    to = ['to@example.com']
+    body_template = '<p><a href="/static" title="see href=/foo">Static</a>{{ link.html }}</p>'
+
+
+class ExtendingTemplate(LinksTemplate):
+    body_template = None
+    body_template_name = 'mail/child.html'
+
+
+class MakeLinksAbsoluteTests(unittest.TestCase):
+    def render(self, template_class, context=None):
+        request = RequestFactory().get('/')
+        email = template_class().render(context, request=request, make_links_absolute=True)
+        return email.body
+
+    def test_only_link_attributes_are_rewritten(self):
+        html = ('<a title="see href=/foo" href=/bar>href="/baz"</a>'
+                '<img alt=\'src="x"\' src="img.png">')
+        self.assertEqual(
+            _make_links_absolute(html, 'https://example.com/'),
+            '<a title="see href=/foo" href=https://example.com/bar>href="/baz"</a>'
+            '<img alt=\'src="x"\' src="https://example.com/img.png">',
+        )
+
+    def test_safe_value_through_attribute(self):
+        self.assertEqual(
+            self.render(LinksTemplate, {'link': Link()}),
+            '<p><a href="https://example.com/static" title="see href=/foo">Static</a>'
+            '<a href="https://example.com/nested">Nested</a></p>',
+        )
+
+    def test_relative_extends(self):
+        self.assertEqual(
+            self.render(ExtendingTemplate),
+            '<p><a href="https://example.com/base">Base</a>'
+            '<a href="https://example.com/child">Child</a></p>',
+        )
+
+
+class WelcomeTemplate(EmailTemplate):
+    subject_template = 'Welcome {{ name }}'
+    from_email = 'from@example.com'
+    to_template = '{{ name }}@example.com'
+    body_template = 'Hello {{ name }}'
+
+
+@unittest.skipIf(aiosmtplib is None, "aiosmtplib isn't installed")
+class AsyncSendTests(unittest.TestCase):
+    def setUp(self):
+        self.server = SMTPServer(delay=0.05)
+        self.port = self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_asend(self):
+        with override_settings(EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.port):
+            self.assertEqual(asyncio.run(WelcomeTemplate.asend(name='ann')), 1)
+        (sender, recipients, data), = self.server.messages
+        self.assertEqual((sender, recipients), ('from@example.com', ['ann@example.com']))
+        self.assertIn(b'Subject: Welcome ann', data)
+
+    def test_asend_mass(self):
+        contexts = [{'name': 'user%d' % i} for i in range(12)]
+        contexts[5] = {'name': 'refused'}
+        results = asyncio.run(WelcomeTemplate.asend_mass(
+            contexts, concurrency=3, hostname='127.0.0.1', port=self.port))
+        
+        self.assertEqual([result.recipients for result in results],
+                         [['%s@example.com' % context['name']] for context in contexts])
+        self.assertEqual([result.sent for result in results],
+                         [i != 5 for i in range(12)])
+        self.assertIsInstance(results[5].error, aiosmtplib.SMTPRecipientsRefused)
+        self.assertEqual(len(self.server.messages), 11)
+        # Messages are sent 3 at a time, each worker reusing its connection.
+        self.assertEqual(self.server.peak, 3)
+        self.assertEqual(self.server.sessions, 3)
+
+    def test_asend_mass_connection_error(self):
+        stopped = SMTPServer()
+        port = stopped.start()
+        stopped.stop()
+        results = asyncio.run(WelcomeTemplate.asend_mass(
+            [{'name': 'ann'}], hostname='127.0.0.1', port=port))
+        self.assertFalse(results[0].sent)
+        self.assertIsInstance(results[0].error, aiosmtplib.SMTPConnectError)
+
+
+class NewsletterTemplate(EmailTemplate):
+    subject_template = 'News from {{ site.name }}'
+    from_email_template = 'News <news@{{ site.domain }}>'
+    to_template = '{{ name }}@example.com'
+    body_template = 'Hello {{ name }}, welcome to {{ site.name }}'
+    bcc = ['archive@example.com']
+
+
+class PrepareTests(unittest.TestCase):
+    def test_invariant_fields_are_rendered_once(self):
+        site = {'name': 'Example', 'domain': 'example.com'}
+        prepared = NewsletterTemplate().prepare({'site': site})
+        self.assertEqual(sorted(prepared.varying_fields), ['body', 'to'])
+        
+        site['name'] = 'Changed'
+        email = prepared.render({'name': 'ann'})
+        self.assertEqual(email.subject, 'News from Example')
+        self.assertEqual(email.from_email, 'News <news@example.com>')
+        self.assertEqual(email.to, ['ann@example.com'])
+        self.assertEqual(email.body, 'Hello ann, welcome to Changed')
+
+    def test_same_as_render(self):
+        context = {'site': {'name': 'Example', 'domain': 'example.com'}}
+        prepared = NewsletterTemplate().prepare(context).render({'name': 'ann'})
+        context['name'] = 'ann'
+        rendered = NewsletterTemplate().render(context)
+        for attr in ('subject', 'from_email', 'to', 'cc', 'bcc', 'body', 'extra_headers'):
+            self.assertEqual(getattr(prepared, attr), getattr(rendered, attr))
+
+    def test_lists_arent_shared(self):
+        prepared = NewsletterTemplate().prepare({'site': {}})
+        prepared.render({'name': 'ann'}).bcc.append('other@example.com')
+        self.assertEqual(prepared.render({'name': 'bob'}).bcc, ['archive@example.com'])
+
+    def test_overridden_shared_variables(self):
+        class GreetingTemplate(NewsletterTemplate):
+            subject_template = 'Hi {{ name }}'
+        prepared = GreetingTemplate().prepare({'name': 'everyone', 'site': {}})
+        self.assertIn('subject', prepared.invariant_fields)
+        self.assertEqual(prepared.render({'name': 'Bob'}).subject, 'Hi Bob')
+        self.assertEqual(prepared.render().subject, 'Hi everyone')
+
+    def test_tags_that_cant_be_analysed(self):
+        class IncludingTemplate(NewsletterTemplate):
+            subject_template = '{% include "mail/base.html" %}'
+        prepared = IncludingTemplate().prepare({'site': {}})
+        self.assertIn('subject', prepared.varying_fields)
+
+
+class AttachmentsTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'report.pdf')
+        with open(self.path, 'wb') as f:
+            f.write(os.urandom(10000))
+
+    def template_class(self):
+        class ReportTemplate(NewsletterTemplate):
+            attachments_template = [
+                self.path,
+                '{% if name == "ann" %}' + os.path.join(self.directory, 'empty.txt') + '{% endif %}',
+            ]
+        open(os.path.join(self.directory, 'empty.txt'), 'wb').close()
+        return ReportTemplate
+
+    def test_attachments(self):
+        email = self.template_class()().render({'name': 'ann', 'site': {}})
+        parsed = message_from_bytes(email.message().as_bytes())
+        attachments = [(part.get_filename(), part.get_content_type(), part.get_payload(decode=True))
+                       for part in parsed.walk() if part.get_filename()]
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        self.assertEqual(attachments, [('report.pdf', 'application/pdf', content),
+                                       ('empty.txt', 'text/plain', b'')])
+
+    def test_encoding_is_shared(self):
+        template = self.template_class()()
+        first, second = [template.render({'name': name, 'site': {}}) for name in ('bob', 'eve')]
+        self.assertEqual(len(first.attachments), 1)
+        self.assertIs(first.attachments[0].get_payload(), second.attachments[0].get_payload())
+
+    def test_changed_file_is_encoded_again(self):
+        template = self.template_class()()
+        before = template.render({'name': 'bob', 'site': {}}).attachments[0].get_payload()
+        with open(self.path, 'wb') as f:
+            f.write(b'changed')
+        after = template.render({'name': 'bob', 'site': {}}).attachments[0].get_payload()
+        self.assertNotEqual(before, after)
+        self.assertEqual(base64.b64decode(after), b'changed')
+
+
+class TemplateCacheTests(unittest.TestCase):
+    def template_class(self):
+        class PageTemplate(EmailTemplate):
+            subject_template = 'Page {{ name }}'
+            body_template_name = 'mail/base.html'
+        return PageTemplate
+
+    def compiled(self, template_class, attr):
+        return template_class()._fetch_attr(attr)[0]
+
+    def test_class_cache(self):
+        PageTemplate = self.template_class()
+        subject = self.compiled(PageTemplate, 'subject')
+        self.assertIs(self.compiled(PageTemplate, 'subject'), subject)
+        self.assertIs(self.compiled(PageTemplate, 'body'), self.compiled(PageTemplate, 'body'))
+        
+        class OtherTemplate(PageTemplate):
+            subject_template = 'Other {{ name }}'
+        self.assertEqual(OtherTemplate().render({'name': 'x'}).subject, 'Other x')
+        self.assertIs(self.compiled(PageTemplate, 'subject'), subject)
+        
+        template = PageTemplate()
+        template.subject_template = 'Changed'
+        self.assertEqual(template.render({}).subject, 'Changed')
+
+    def test_setting_changed(self):
+        PageTemplate = self.template_class()
+        self.assertIn('Base', PageTemplate().render({}).body)
+        templates = [dict(settings.TEMPLATES[0], OPTIONS=dict(
+            settings.TEMPLATES[0]['OPTIONS'],
+            loaders=[('django.template.loaders.locmem.Loader', {'mail/base.html': 'New'})],
+        ))]
+        with override_settings(TEMPLATES=templates):
+            self.assertEqual(PageTemplate().render({}).body, 'New')
+        self.assertIn('Base', PageTemplate().render({}).body)
+
+    def test_file_changed(self):
+        from django.utils.autoreload import file_changed
+        
+        PageTemplate = self.template_class()
+        subject = self.compiled(PageTemplate, 'subject')
+        file_changed.send(sender=None, file_path=Path('mail/base.html'))
+        self.assertIsNot(self.compiled(PageTemplate, 'subject'), subject)
+
+
+def counted(contexts, counter):
+    for context in contexts:
+        counter.append(context)
+        yield context
+
+
+class RenderManyTests(unittest.TestCase):
+    def contexts(self, count):
+        return [{'name': 'user%d' % i, 'site': {'name': 'Example'}} for i in range(count)]
+
+    def test_ordered(self):
+        messages = NewsletterTemplate.render_many(self.contexts(10), workers=2, chunk_size=3)
+        self.assertEqual([msg.to for msg in messages],
+                         [['user%d@example.com' % i] for i in range(10)])
+
+    def test_unordered(self):
+        messages = list(NewsletterTemplate.render_many(self.contexts(10), workers=2,
+                                                       ordered=False, chunk_size=3))
+        self.assertEqual(sorted(msg.to[0] for msg in messages),
+                         sorted('user%d@example.com' % i for i in range(10)))
+
+    def test_in_flight_bound(self):
+        consumed = []
+        messages = NewsletterTemplate.render_many(counted(self.contexts(100), consumed),
+                                                  workers=1, chunk_size=2, max_in_flight=2)
+        next(messages)
+        # Two chunks submitted, and a third one once the first is done.
+        self.assertEqual(len(consumed), 6)
+        self.assertEqual(len(list(messages)), 99)
+        self.assertEqual(len(consumed), 100)
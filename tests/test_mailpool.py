@@ -0,0 +1,163 @@
+import smtplib
+import threading
+import time
+import unittest
+
+from django.core.mail import EmailMessage, get_connection
+from django.test import override_settings
+
+from toolbox.emails import EmailTemplate
+from toolbox.mailpool import ConnectionPool, get_pool
+
+from smtp_server import SMTPServer
+
+
+class NoticeTemplate(EmailTemplate):
+    subject = 'Notice'
+    from_email = 'from@example.com'
+    to_template = '{{ name }}@example.com'
+    body = 'Body'
+
+
+class ConnectionPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.server = SMTPServer()
+        self.port = self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def make_pool(self, **kwargs):
+        pool = ConnectionPool(backend='django.core.mail.backends.smtp.EmailBackend',
+                              host='127.0.0.1', port=self.port, **kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def message(self):
+        return EmailMessage('Subject', 'Body', 'from@example.com', ['to@example.com'])
+
+    def test_connection_reuse(self):
+        pool = self.make_pool()
+        for i in range(5):
+            self.assertEqual(pool.send_messages([self.message()]), 1)
+        self.assertEqual(len(self.server.messages), 5)
+        self.assertEqual(self.server.sessions, 1)
+
+    def test_size(self):
+        self.server.delay = 0.02
+        pool = self.make_pool(size=2)
+        threads = [threading.Thread(target=pool.send_messages, args=([self.message()],))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.server.messages), 8)
+        self.assertLessEqual(self.server.sessions, 2)
+        self.assertEqual(self.server.peak, 2)
+
+    def test_health_check(self):
+        pool = self.make_pool()
+        checks = []
+        is_healthy = pool._is_healthy
+        pool._is_healthy = lambda connection: checks.append(connection) or is_healthy(connection)
+        for i in range(3):
+            pool.send_messages([self.message()])
+        # Connections released just before aren't checked.
+        self.assertEqual(checks, [])
+        pool.health_check_after = 0
+        pool.send_messages([self.message()])
+        self.assertEqual(len(checks), 1)
+        self.assertEqual(self.server.sessions, 1)
+
+    def test_dropped_connection_is_replaced(self):
+        pool = self.make_pool(health_check_after=0)
+        pool.send_messages([self.message()])
+        self.server.drop_connections()
+        time.sleep(0.1)
+        self.assertEqual(pool.send_messages([self.message()]), 1)
+        self.assertEqual(self.server.sessions, 2)
+
+    def test_send_is_retried_once_on_disconnection(self):
+        pool = self.make_pool()
+        pool.send_messages([self.message()])
+        self.server.drop_connections()
+        time.sleep(0.1)
+        # The connection is reused without a health check but fails.
+        self.assertEqual(pool.send_messages([self.message()]), 1)
+        self.assertEqual(len(self.server.messages), 2)
+
+    def test_all_connections_dropped(self):
+        pool = self.make_pool()
+        connections = [pool.acquire(), pool.acquire()]
+        for connection in connections:
+            pool.release(connection)
+        self.server.drop_connections()
+        time.sleep(0.1)
+        self.assertEqual(pool.send_messages([self.message()]), 1)
+        self.assertEqual(self.server.sessions, 3)
+
+    def test_idle_timeout(self):
+        pool = self.make_pool(idle_timeout=0)
+        pool.send_messages([self.message()])
+        time.sleep(0.01)
+        pool.send_messages([self.message()])
+        self.assertEqual(self.server.sessions, 2)
+
+    def test_send_immediately_uses_the_pool(self):
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                               EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.port):
+            for name in ('ann', 'bob'):
+                self.assertEqual(NoticeTemplate.send_immediately(name=name), 1)
+            get_pool().close()
+        self.assertEqual([recipients for sender, recipients, data in self.server.messages],
+                         [['ann@example.com'], ['bob@example.com']])
+        self.assertEqual(self.server.sessions, 1)
+
+
+class SendMassTests(unittest.TestCase):
+    def setUp(self):
+        self.server = SMTPServer()
+        self.port = self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def connection(self):
+        return get_connection('django.core.mail.backends.smtp.EmailBackend',
+                              host='127.0.0.1', port=self.port)
+
+    def test_send_mass(self):
+        contexts = [{'name': name} for name in ('ann', 'refused', 'bob')]
+        results = NoticeTemplate.send_mass(contexts, batch_size=2, connection=self.connection())
+        self.assertEqual([(result.recipients, result.sent) for result in results], [
+            (['ann@example.com'], True),
+            (['refused@example.com'], False),
+            (['bob@example.com'], True),
+        ])
+        self.assertIsInstance(results[1].error, smtplib.SMTPRecipientsRefused)
+        self.assertEqual(len(self.server.messages), 2)
+
+    def test_dropped_connection(self):
+        server = self.server
+
+        class DroppingTemplate(NoticeTemplate):
+            def render(self, context=None, request=None):
+                if context['name'] == 'user2':
+                    server.drop_connections()
+                    time.sleep(0.1)
+                return super(DroppingTemplate, self).render(context, request)
+
+        results = DroppingTemplate.send_mass([{'name': 'user%d' % i} for i in range(5)],
+                                             batch_size=1, connection=self.connection())
+        self.assertEqual([result.sent for result in results], [True, True, False, True, True])
+        self.assertEqual(len(self.server.messages), 4)
+
+    def test_render_error(self):
+        class FailingTemplate(NoticeTemplate):
+            def render_subject(self, context):
+                if context['name'] == 'bob':
+                    raise ValueError("Can't render")
+                return super(FailingTemplate, self).render_subject(context)
+
+        results = FailingTemplate.send_mass([{'name': 'bob'}, {'name': 'ann'}],
+                                            connection=self.connection())
+        self.assertEqual([(result.recipients, result.sent) for result in results],
+                         [(None, False), (['ann@example.com'], True)])
+        self.assertIsInstance(results[0].error, ValueError)
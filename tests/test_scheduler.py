@@ -0,0 +1,90 @@
+import threading
+import time
+import unittest
+
+from django.core.mail import EmailMessage
+
+from toolbox.scheduler import DomainScheduler, TokenBucket
+
+
+class FakeConnection(object):
+    """Record the messages sent and the number of concurrent sends by domain."""
+    lock = threading.Lock()
+
+    def __init__(self, log):
+        self.log = log
+
+    def open(self):
+        return False
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        recipient = messages[0].to[0]
+        domain = recipient.split('@')[1]
+        with self.lock:
+            self.log['active'][domain] = self.log['active'].get(domain, 0) + 1
+            self.log['peak'][domain] = max(self.log['peak'].get(domain, 0),
+                                           self.log['active'][domain])
+            self.log['sent'].append(domain)
+        time.sleep(0.05 if domain == 'slow.example.com' else 0.001)
+        with self.lock:
+            self.log['active'][domain] -= 1
+        if recipient.startswith('failing'):
+            raise IOError("Refused")
+        return 1
+
+
+class DomainSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.log = {'active': {}, 'peak': {}, 'sent': []}
+
+    def scheduler(self, **kwargs):
+        return DomainScheduler(connection_factory=lambda: FakeConnection(self.log), **kwargs)
+
+    def message(self, recipient):
+        return EmailMessage('Subject', 'Body', 'from@example.com', [recipient])
+
+    def test_concurrency_and_interleaving(self):
+        scheduler = self.scheduler(concurrency=2, threads=6,
+                                   limits={'b.example.com': {'concurrency': 1}})
+        for domain in ('slow.example.com', 'b.example.com'):
+            for i in range(6):
+                scheduler.add(self.message('user%d@%s' % (i, domain)))
+        stats = scheduler.run()
+
+        self.assertEqual(self.log['peak'], {'slow.example.com': 2, 'b.example.com': 1})
+        self.assertEqual(stats['slow.example.com'].sent, 6)
+        self.assertEqual(stats['b.example.com'].sent, 6)
+        # The slow domain doesn't hold up the other one.
+        self.assertEqual(self.log['sent'][-1], 'slow.example.com')
+
+    def test_rate(self):
+        scheduler = self.scheduler(rate=50, burst=1)
+        for i in range(6):
+            scheduler.add(self.message('user%d@a.example.com' % i))
+        stats = scheduler.run()
+        self.assertGreaterEqual(stats['a.example.com'].elapsed, 0.09)
+        self.assertLessEqual(stats['a.example.com'].rate, 60)
+
+    def test_failures(self):
+        scheduler = self.scheduler()
+        failing = self.message('failing@A.example.com')
+        scheduler.add(failing)
+        scheduler.add(self.message('user@a.example.com'))
+        stats = scheduler.run()
+        self.assertEqual((stats['a.example.com'].sent, stats['a.example.com'].failed), (1, 1))
+        (message, error), = scheduler.failures
+        self.assertIs(message, failing)
+        self.assertIsInstance(error, IOError)
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_bucket(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        now = bucket.updated
+        bucket.take(now)
+        bucket.take(now)
+        self.assertAlmostEqual(bucket.delay(now), 0.1)
+        self.assertEqual(bucket.delay(now + 0.11), 0)
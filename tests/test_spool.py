@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from django.core.mail import EmailMessage
+
+from toolbox.spool import EmailSpool
+
+
+class FakeConnection(object):
+    """An email backend connection failing while it's marked as dropped."""
+    def __init__(self):
+        self.dropped = False
+        self.sent = []
+        self.closed = 0
+
+    def send_messages(self, messages):
+        if self.dropped:
+            raise IOError("Connection dropped")
+        self.sent.extend(messages)
+        return len(messages)
+
+    def close(self):
+        self.closed += 1
+        self.dropped = False
+
+
+class EmailSpoolTests(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.spool = EmailSpool(self.path)
+        self.spool.fsync = False
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def listdir(self, directory):
+        return os.listdir(os.path.join(self.path, directory))
+
+    def put(self, subject, delay=0):
+        # Messages put in the same millisecond have no particular order.
+        self.spool.put(self.message(subject), not_before=time.time() - 10 + delay)
+
+    def message(self, subject):
+        return EmailMessage(subject, 'Body', 'from@example.com', ['to@example.com'])
+
+    def test_deliver_in_order(self):
+        for i in range(5):
+            self.put('Message %d' % i, i)
+        connection = FakeConnection()
+        while self.spool.deliver(connection):
+            pass
+        self.assertEqual([m.subject for m in connection.sent],
+                         ['Message %d' % i for i in range(5)])
+        self.assertEqual(self.listdir('new') + self.listdir('cur'), [])
+
+    def test_claim_lists_the_directory_once(self):
+        for i in range(3):
+            self.spool.put(self.message('Message %d' % i))
+        listdir = os.listdir
+        calls = []
+        os.listdir = lambda path: calls.append(path) or listdir(path)
+        try:
+            while self.spool.claim():
+                pass
+        finally:
+            os.listdir = listdir
+        # Once for the due messages, once to find there are no more.
+        self.assertEqual(len(calls), 2)
+
+    def test_future_messages_arent_claimed(self):
+        self.spool.put(self.message('Later'), not_before=time.time() + 3600)
+        self.assertIsNone(self.spool.claim())
+
+    def test_failure_closes_connection_and_retries(self):
+        self.put('First')
+        self.put('Second', 1)
+        connection = FakeConnection()
+        connection.dropped = True
+        self.spool.deliver(connection)
+        self.assertEqual(connection.closed, 1)
+        # The next message goes through the reopened connection, the failed
+        # one waits for its backoff.
+        self.spool.deliver(connection)
+        self.assertEqual([m.subject for m in connection.sent], ['Second'])
+        name, = self.listdir('new')
+        self.assertEqual(name.split('-')[1], '1')
+
+    def test_dead_letters(self):
+        self.spool.max_attempts = 1
+        self.spool.put(self.message('Failing'))
+        connection = FakeConnection()
+        connection.dropped = True
+        self.spool.deliver(connection)
+        self.assertEqual(len(self.listdir('dead')), 1)
+
+    def test_unreadable_message(self):
+        self.put('Corrupted')
+        name, = self.listdir('new')
+        with open(os.path.join(self.path, 'new', name), 'wb') as f:
+            f.write(b'not a pickle')
+        self.put('Valid', 1)
+        name, message, attempts = self.spool.claim()
+        self.assertEqual(message.subject, 'Valid')
+        self.assertEqual(len(self.listdir('dead')), 1)
+
+    def test_recover(self):
+        self.spool.put(self.message('Stale'))
+        name, message, attempts = self.spool.claim()
+        self.spool.stale_timeout = -1
+        self.assertEqual(self.spool.recover(), 1)
+        self.assertEqual(self.listdir('new'), [name])
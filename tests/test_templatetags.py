@@ -0,0 +1,100 @@
+from collections import namedtuple
+import unittest
+
+from django.template import TemplateSyntaxError, Variable, engines
+
+from toolbox.claude import Axis, DataPointsCloud
+
+Sale = namedtuple('Sale', 'region month amount')
+
+
+class CloudPivotTests(unittest.TestCase):
+    def render(self, source, context):
+        template = engines['django'].from_string('{% load claude %}' + source)
+        return template.render(context)
+
+    def test_pivot(self):
+        cloud = DataPointsCloud([Axis('region'), Axis('month')], 0)
+        cloud.load_data([Sale('EU', 1, 1), Sale('EU', 2, 2), Sale('US', 1, 3)],
+                        lambda row, current: current + row.amount)
+        output = self.render(
+            '{% cloud_pivot cloud rows="region" cols="month" as table %}'
+            '{% for row, cells, total in table.rows %}{{ row }}:{{ cells|join:"," }}={{ total }} {% endfor %}'
+            '{{ table.total }}',
+            {'cloud': cloud},
+        )
+        self.assertEqual(output, 'EU:1,2=3 US:3,0=3 6')
+
+    def test_missing_arguments(self):
+        for arguments in ['rows="region" as table', 'cols="month" as table',
+                          'rows="region" cols="month"']:
+            with self.assertRaises(TemplateSyntaxError):
+                self.render('{% cloud_pivot cloud ' + arguments + ' %}', {})
+
+
+class CloudTotalTests(unittest.TestCase):
+    def test_backends_render_the_same(self):
+        from toolbox.claude import ArrayDataPointsCloud, CompactDataPointsCloud, numpy
+        
+        classes = [DataPointsCloud, CompactDataPointsCloud]
+        if numpy is not None:
+            classes.append(ArrayDataPointsCloud)
+        template = engines['django'].from_string(
+            '{% load claude %}{% cloud_total cloud region="EU" as total %}{{ total }}')
+        for cloud_class in classes:
+            cloud = cloud_class([Axis('region'), Axis('month')], 0)
+            cloud.load_data([Sale('EU', 1, 1), Sale('EU', 2, 3), Sale('US', 1, 3)],
+                            lambda row, current: current + row.amount)
+            self.assertEqual(template.render({'cloud': cloud}), '4', cloud_class)
+
+
+class CountingCloud(DataPointsCloud):
+    def __init__(self, *args, **kwargs):
+        super(CountingCloud, self).__init__(*args, **kwargs)
+        self.queries = 0
+
+    def sum_(self, **filters):
+        self.queries += 1
+        return super(CountingCloud, self).sum_(**filters)
+
+
+class CloudArgumentsTests(unittest.TestCase):
+    def setUp(self):
+        self.cloud = CountingCloud([Axis('region'), Axis('month')], 0)
+        self.cloud.load_data([Sale('EU', 1, 1), Sale('EU', 2, 3), Sale('US', 1, 3)],
+                             lambda row, current: current + row.amount)
+
+    def template(self, source):
+        return engines['django'].from_string('{% load claude %}' + source)
+
+    def test_literals(self):
+        template = self.template('{% cloud_total cloud region="EU" month=1 as total %}')
+        node = template.template.nodelist[1]
+        self.assertEqual(node.keyvalues, [('region', 'EU', True), ('month', 1, True)])
+
+    def test_variables(self):
+        template = self.template(
+            '{% cloud_total cloud region=region month=_("1") as total %}{{ total }}')
+        keyvalues = template.template.nodelist[1].keyvalues
+        for key, value, is_literal in keyvalues:
+            self.assertIsInstance(value, Variable)
+            self.assertFalse(is_literal)
+        self.assertEqual(template.render({'cloud': self.cloud, 'region': 'US'}), '0')
+        template = self.template('{% cloud_total cloud region=_("EU") as total %}{{ total }}')
+        self.assertEqual(template.render({'cloud': self.cloud}), '4')
+
+    def test_memoization(self):
+        template = self.template(
+            '{% cloud_total cloud region="EU" as a %}{% cloud_total cloud region=region as b %}'
+            '{% cloud_total cloud region="US" as c %}{{ a }} {{ b }} {{ c }}')
+        self.assertEqual(template.render({'cloud': self.cloud, 'region': 'EU'}), '4 4 3')
+        self.assertEqual(self.cloud.queries, 2)
+        # The memo only lasts for one rendering.
+        template.render({'cloud': self.cloud, 'region': 'EU'})
+        self.assertEqual(self.cloud.queries, 4)
+
+    def test_unhashable_arguments(self):
+        template = self.template('{% cloud_total cloud region__in=regions as a %}'
+                                 '{% cloud_total cloud region__in=regions as b %}{{ a }}{{ b }}')
+        self.assertEqual(template.render({'cloud': self.cloud, 'regions': ['EU', 'US']}), '77')
+        self.assertEqual(self.cloud.queries, 2)
@@ -1,17 +1,54 @@
-from collections import defaultdict
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict, namedtuple
+from functools import partial, reduce
+from itertools import islice
+from multiprocessing import Pool
+from operator import add, attrgetter, itemgetter, or_
+import heapq
+import mmap
+import os
+import pickle
+import struct
+import sys
+import threading
+
+try:
+    import numpy
+except ImportError: # numpy is only needed by ArrayDataPointsCloud
+    numpy = None
 
 class Axis(object):
     """An axis is characterized by two properties:
         * A name (more readable than a numerical list index),
         * A projection method that knows how to extract the relevant coordinate
             out of a row object.
+    
+    When the coordinate is a field of the row object, the name of that field
+    can be given as `field` (it defaults to the name of the axis when there's
+    no custom projection). This lets DataPointsCloud.load_queryset() fetch only
+    the columns it needs.
+    
+    Coarser levels of the axis can be declared as a list of (name, function)
+    pairs, each function mapping a coordinate of the previous level (the axis
+    itself for the first one) to a coordinate of the level. For example, with
+    a day axis: [('month', to_month), ('quarter', to_quarter), ('year', to_year)].
+    A DataPointsCloud keeps the totals at each level, which can be queried
+    by using the name of the level like an axis name. Numeric values can be
+    binned with a level using Bins (eg: [('price_range', Bins(100))]).
+    
+    Axes hold no data, so that the same axes can be shared by several clouds.
     """
-    def __init__(self, name, projection=None):
+    def __init__(self, name, projection=None, field=None, levels=()):
+        self.has_custom_projection = projection is not None
         if projection is None:
-            projection = lambda row: getattr(row, name)
+            field = field or name
+            projection = attrgetter(field)
         
         self.name = name
         self.projection = projection
+        self.field = field
+        self.levels = list(levels)
     
     def project(self, row):
         """Projects the row object onto the axis.
@@ -21,24 +58,239 @@ class Axis(object):
         return self.projection(row)
 
 
+class _Vocabulary(object):
+    """The coordinates seen by a cloud on one of its axes, used to
+    dictionary-encode them as small integer codes (0, 1, 2, ...).
+    """
+    def __init__(self, coordinates=()):
+        self.coordinates = []
+        self._codes = {}
+        self._lock = threading.Lock()
+        for coordinate in coordinates:
+            self.encode(coordinate)
+    
+    def __len__(self):
+        return len(self.coordinates)
+    
+    def encode(self, coordinate):
+        """Return the integer code of the given coordinate, adding it to the
+        vocabulary if it's not already there.
+        """
+        try:
+            return self._codes[coordinate]
+        except KeyError:
+            with self._lock:
+                if coordinate not in self._codes:
+                    self._codes[coordinate] = len(self.coordinates)
+                    self.coordinates.append(coordinate)
+                return self._codes[coordinate]
+    
+    def code_of(self, coordinate):
+        """Return the integer code of the given coordinate, or None if it has
+        never been encoded.
+        """
+        return _lookup(self._codes, coordinate)
+    
+    def decode(self, code):
+        """The inverse of encode()."""
+        return self.coordinates[code]
+
+
+class Bins(object):
+    """A level function putting numbers into bins of the given width.
+    Each number is mapped to the lower bound of its bin.
+    """
+    def __init__(self, width, origin=0):
+        self.width = width
+        self.origin = origin
+    
+    def __call__(self, value):
+        return self.origin + (value - self.origin) // self.width * self.width
+
+
 class DataPointsCloud(object):
     """A N-dimensional system of data points.
     Behind the scene, a defaultdict is used for the storage of points.
-    Its default value can be customized in the __init__ method."""
+    Its default value can be customized in the __init__ method.
+    
+    For each axis, an inverted index mapping a coordinate to the set of points
+    that have it is maintained as data is loaded, so that "equals" and "in"
+    filters are answered by set intersections instead of a full scan.
+    
+    Totals over some subsets of axes can be materialized by passing their
+    names as `marginals` (eg: [('month',), ('region',), ()] for row totals,
+    column totals and the grand total). They are kept up to date as data is
+    loaded, so that sum_() with equality filters on exactly one of those
+    subsets is answered in constant time. Values must support addition and
+    subtraction for this.
+    
+    The results of values_at() and sum_() are kept in a LRU cache of
+    cache_size entries, keyed by the filters. The cache is invalidated
+    whenever data is loaded, which bumps the version of the cloud."""
     
     available_axis_lookups = {
         'in': lambda filter, actual: actual in filter,
         'equals': lambda filter, actual: actual == filter,
+        'gt': lambda filter, actual: actual > filter,
+        'gte': lambda filter, actual: actual >= filter,
+        'lt': lambda filter, actual: actual < filter,
+        'lte': lambda filter, actual: actual <= filter,
+        'range': lambda filter, actual: filter[0] <= actual <= filter[1],
     }
     
-    def __init__(self, axes=None, default_factory=None):
+    # Lookups answered by bisecting the sorted coordinates of an axis:
+    # they map the filter value and the sorted coordinates to a slice of them.
+    range_axis_lookups = {
+        'gt': lambda filter, keys: slice(bisect_right(keys, filter), None),
+        'gte': lambda filter, keys: slice(bisect_left(keys, filter), None),
+        'lt': lambda filter, keys: slice(None, bisect_left(keys, filter)),
+        'lte': lambda filter, keys: slice(None, bisect_right(keys, filter)),
+        'range': lambda filter, keys: slice(bisect_left(keys, filter[0]),
+                                            bisect_right(keys, filter[1])),
+    }
+    
+    cache_size = 128
+    
+    def __init__(self, axes=None, default_factory=None, marginals=()):
         if not callable(default_factory):
-            default_factory = lambda: default_factory
+            default_factory = partial(_constant, default_factory)
         self._dict = defaultdict(default_factory)
         
         if axes is None:
             axes = []
         self.axes = axes
+        self._axis_indexes = dict((axis.name, i) for i, axis in enumerate(axes))
+        self._index = [defaultdict(set) for axis in axes]
+        # The insertion sequence number of each point, to return the points
+        # found with the indexes in load order.
+        self._sequence = {}
+        self._next_sequence = 0
+        self._sorted_coordinates = [None for axis in axes]
+        self._plans = {}
+        self.version = 0
+        self._cache = OrderedDict()
+        self._cache_version = 0
+        self._cache_hits = self._cache_misses = 0
+        self.watermark = None
+        self._marginals = {}
+        for names in marginals:
+            for name in names:
+                if name not in self._axis_indexes:
+                    raise ValueError("Unknown axis %r in marginals %r." % (name, names))
+            indexes = tuple(self.get_axis_index(name) for name in names)
+            self._marginals[frozenset(names)] = (indexes, defaultdict(int))
+        self._init_levels()
+        self._has_aggregates = bool(self._marginals or self._levels)
+    
+    @classmethod
+    def from_queryset(cls, queryset, axes, measure, combine=add, make_point=None,
+                      chunk_size=2000, **kwargs):
+        """Return a new cloud whose values are the given aggregate
+        (eg: Sum('amount')) of the rows of the queryset at each point.
+        
+        When all axes declare a field, the aggregation is pushed down to the
+        database with values(*fields).annotate(measure) and only the aggregated
+        rows are loaded. Aggregated rows landing on the same point (because of
+        a custom projection) are folded together with combine, which is only
+        right for additive measures like Sum and Count unless another combine
+        function is given (eg: max for Max).
+        
+        Otherwise, all rows are loaded and folded with make_point, which
+        defaults to counting the rows for Count and to combining the summed
+        field for Sum. Other measures need an explicit make_point.
+        Extra keyword arguments are passed to the constructor; the default
+        value of points is 0 unless a default_factory is given.
+        """
+        kwargs.setdefault('default_factory', int)
+        cloud = cls(axes, **kwargs)
+        
+        if all(axis.field is not None for axis in cloud.axes):
+            fields = []
+            for axis in cloud.axes:
+                if axis.field not in fields:
+                    fields.append(axis.field)
+            queryset = queryset.order_by().values(*fields).annotate(cloud_measure=measure)
+            make_point = lambda row, current: combine(current, row.cloud_measure)
+            cloud.load_queryset(queryset, make_point, ['cloud_measure'], chunk_size)
+            return cloud
+        
+        fields = []
+        if make_point is None:
+            from django.db.models import Count, Sum
+            
+            source = measure.get_source_expressions()[0]
+            simple = not getattr(measure, 'distinct', False) and measure.filter is None
+            if isinstance(measure, Count) and simple:
+                make_point = lambda row, current: combine(current, 1)
+            elif isinstance(measure, Sum) and simple and hasattr(source, 'name'):
+                get_value = attrgetter(source.name)
+                make_point = lambda row, current: combine(current, get_value(row))
+                fields.append(source.name)
+            else:
+                raise ValueError("Can't aggregate %r in Python, a make_point "
+                                 "function is needed." % measure)
+        cloud.load_queryset(queryset, make_point, fields, chunk_size)
+        return cloud
+    
+    def dump(self, path):
+        """Write a snapshot of the cloud to the given path, to be opened
+        later with DataPointsCloud.open().
+        
+        The file holds a header with the vocabulary of each axis, followed by
+        the points: their coordinates, packed into a 64-bit integer key made
+        of the codes of the coordinates on each axis, and their values.
+        Keys are sorted and values must be numbers.
+        """
+        vocabularies = [{} for axis in self.axes]
+        coded_points = []
+        for coordinates, value in self.points():
+            codes = tuple(vocabulary.setdefault(c, len(vocabulary))
+                          for vocabulary, c in zip(vocabularies, coordinates))
+            coded_points.append((codes, value))
+        
+        widths = [max(1, (len(vocabulary) - 1).bit_length()) for vocabulary in vocabularies]
+        if sum(widths) > 63:
+            raise ValueError("Too many distinct coordinates to pack keys in 64 bits.")
+        
+        coded_points = sorted((_pack_codes(codes, widths), value)
+                              for codes, value in coded_points)
+        keys = array('q', [key for key, value in coded_points])
+        values = [value for key, value in coded_points]
+        if all(isinstance(value, int) for value in values):
+            values = array('q', values)
+        else:
+            values = array('d', [float(value) for value in values])
+        
+        header = pickle.dumps({
+            'axes': [axis.name for axis in self.axes],
+            'vocabularies': [sorted(vocabulary, key=vocabulary.get) for vocabulary in vocabularies],
+            'widths': widths,
+            'typecode': values.typecode,
+            'count': len(keys),
+            'default': self._dict.default_factory(),
+            'byteorder': sys.byteorder,
+        }, pickle.HIGHEST_PROTOCOL)
+        
+        # Write to a temporary file first, so that processes opening
+        # the snapshot never see a partially written file.
+        tmp_path = '%s.tmp%d' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            f.write(b'\0' * (-f.tell() % 8))
+            keys.tofile(f)
+            values.tofile(f)
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def open(cls, path):
+        """Return a read-only cloud memory-mapping the snapshot at the given
+        path (see dump()), so that processes opening the same snapshot share
+        its pages.
+        Note that the header is unpickled: only open trusted snapshots.
+        """
+        return MappedDataPointsCloud(path)
     
     def points(self, iterable=False):
         """Return all points in the system in the form of (coordinates, value).
@@ -68,7 +320,7 @@ class DataPointsCloud(object):
         
         if len(args) != len(self.axes):
             raise ValueError # TODO: throw better exception
-        return args, self._dict[args]
+        return args, self._get(args)
     
     def value_at(self, *args, **kwargs):
         """Return the value situated at the given coordinates.
@@ -85,33 +337,491 @@ class DataPointsCloud(object):
     def get_axis_index(self, axis_name):
         """Return the internal index of the axis with the given name.
         """
-        correspondance_table = dict((axis.name, i) for i, axis in enumerate(self.axes))
-        return correspondance_table.get(axis_name)
+        return self._axis_indexes.get(axis_name)
     
     def load_data(self, data, make_point=None):
         """Load data from an iterable into the internal representation."""
         if make_point is None:
-            make_point = lambda row, current: row
+            make_point = _replace_point
 
-        for row in data:
-            coordinates = tuple(axis.project(row) for axis in self.axes)
-            current_value_at_point = self.value_at(*coordinates)
-            self._dict[coordinates] = make_point(row, current_value_at_point)
+        self._load_rows(data, make_point, self._project)
+    
+    def load_queryset(self, queryset, make_point=None, fields=(), chunk_size=2000):
+        """Load data from a QuerySet, streaming it in chunks of chunk_size rows.
+        
+        Only the fields of the axes (see Axis.field), plus the extra `fields`
+        needed by make_point, are fetched with values_list(): rows are named
+        tuples of those fields instead of model instances, and the coordinates
+        of axes without a custom projection are read by position.
+        If some axis has no declared field, full model instances are needed
+        and loaded instead.
+        """
+        if make_point is None:
+            make_point = _replace_point
+        
+        if any(axis.field is None for axis in self.axes):
+            rows = queryset.iterator(chunk_size=chunk_size)
+            return self._load_rows(rows, make_point, self._project)
+        
+        columns = []
+        for field in [axis.field for axis in self.axes] + list(fields):
+            if field not in columns:
+                columns.append(field)
+        
+        projections = [axis.project if axis.has_custom_projection
+                       else itemgetter(columns.index(axis.field))
+                       for axis in self.axes]
+        project = lambda row: tuple(p(row) for p in projections)
+        
+        rows = queryset.values_list(*columns, named=True).iterator(chunk_size=chunk_size)
+        self._load_rows(rows, make_point, project)
+    
+    def _project(self, row):
+        """Return the coordinates tuple of the given row object."""
+        return tuple(axis.project(row) for axis in self.axes)
+    
+    def _load_rows(self, rows, make_point, project):
+        try:
+            for row in rows:
+                coordinates = project(row)
+                current_value_at_point = self._get(coordinates)
+                self._set(coordinates, make_point(row, current_value_at_point))
+        finally:
+            self.version += 1
+    
+    def load_data_parallel(self, data, make_point=None, combine=None,
+                           processes=None, chunk_size=10000):
+        """Like load_data(), but the data is split into chunks of chunk_size
+        rows that are loaded into partial clouds by a pool of processes.
+        The partial clouds are then merged into this one with merge() and
+        the given combine function, in no particular order.
+        combine defaults to addition when make_point is given. Otherwise
+        points are replaced by the rows loaded last, like load_data() does,
+        so values loaded in different chunks are kept rather than combined.
+        
+        Rows, axes projections, make_point and the default factory all need
+        to be picklable (eg: module-level functions rather than lambdas).
+        """
+        if combine is None:
+            combine = add if make_point is not None else _keep_other
+        if make_point is None:
+            make_point = _replace_point
+        
+        default_factory = self._dict.default_factory
+        tasks = ((self.axes, default_factory, make_point, chunk)
+                 for chunk in _chunks(data, chunk_size))
+        pool = Pool(processes)
+        try:
+            for points in pool.imap_unordered(_load_partial_cloud, tasks):
+                self._merge_points(points, combine)
+        finally:
+            pool.terminate()
+    
+    def merge(self, other, combine=add):
+        """Merge the points of another cloud with the same axes into this one.
+        Values of points present in both clouds are folded together with
+        combine(value_in_self, value_in_other).
+        """
+        if [axis.name for axis in self.axes] != [axis.name for axis in other.axes]:
+            raise ValueError("Can't merge clouds with different axes.")
+        self._merge_points(other.points(), combine)
+        return self
+    
+    def remove_points(self, **filters):
+        """Remove the points matching the filters.
+        Return the number of removed points.
+        """
+        coordinates = [point[0] for point in self._points_at(filters)]
+        try:
+            self._delete(coordinates)
+        finally:
+            self.version += 1
+        return len(coordinates)
+    
+    def replace_slice(self, filters, rows, make_point=None):
+        """Replace the points matching the filters by the ones loaded from
+        the given rows, which must all fall within the slice. The rows are
+        checked before anything is removed, so the cloud is left unchanged
+        when one of them is outside of the slice.
+        """
+        projected = []
+        for row in rows:
+            coordinates = self._project(row)
+            if not self.point_match_filters((coordinates, None), filters):
+                raise ValueError("Row %r is outside of the replaced slice." % (row,))
+            projected.append((coordinates, row))
+        
+        self.remove_points(**filters)
+        make_point = make_point or _replace_point
+        self._load_rows(projected, lambda item, value: make_point(item[1], value), itemgetter(0))
+    
+    def refresh(self, queryset, since_field, make_point=None, fields=(), chunk_size=2000):
+        """Load the rows of the queryset that changed since the last refresh,
+        according to since_field (eg: a "modified" timestamp).
+        
+        The first call loads the whole queryset. Afterwards, the points
+        touched by changed rows are removed and all the rows at those points
+        are loaded again, so that updated rows aren't counted twice. This
+        requires all axes to be plain fields (without custom projections).
+        Note that deleted rows can't be detected this way.
+        """
+        if any(axis.field is None or axis.has_custom_projection for axis in self.axes):
+            raise ValueError("refresh() needs all axes to be plain fields.")
+        
+        from django.db.models import Max, Q
+        
+        watermark = queryset.aggregate(watermark=Max(since_field))['watermark']
+        if watermark is None:
+            return
+        changed = queryset.filter(**{'%s__lte' % since_field: watermark})
+        
+        if self.watermark is None:
+            self.load_queryset(changed, make_point, fields, chunk_size)
+            self.watermark = watermark
+            return
+        
+        changed = changed.filter(**{'%s__gt' % since_field: self.watermark})
+        axis_fields = [axis.field for axis in self.axes]
+        touched = list(changed.order_by().values_list(*axis_fields).distinct())
+        self._delete(touched)
+        for chunk in _chunks(touched, 500):
+            condition = reduce(or_, [Q(**dict(zip(axis_fields, coordinates)))
+                                     for coordinates in chunk])
+            self.load_queryset(queryset.filter(condition), make_point, fields, chunk_size)
+        self.watermark = watermark
+    
+    def _merge_points(self, points, combine):
+        try:
+            for coordinates, value in points:
+                self._set(coordinates, combine(self._get(coordinates), value))
+        finally:
+            self.version += 1
+    
+    def _get(self, coordinates):
+        """Return the value at the given coordinates tuple.
+        Unlike indexing the defaultdict directly, this doesn't create a point.
+        """
+        if coordinates in self._dict:
+            return self._dict[coordinates]
+        return self._dict.default_factory()
+    
+    def _set(self, coordinates, value):
+        """Store the value at the given coordinates tuple, indexing the point
+        if it's a new one.
+        """
+        if coordinates not in self._dict:
+            for i, (index, coordinate) in enumerate(zip(self._index, coordinates)):
+                if coordinate not in index:
+                    self._sorted_coordinates[i] = None
+                index[coordinate].add(coordinates)
+            self._sequence[coordinates] = self._next_sequence
+            self._next_sequence += 1
+        if self._has_aggregates:
+            self._update_aggregates(coordinates, self._get(coordinates), value)
+        self._dict[coordinates] = value
+    
+    def _delete(self, coordinates_list):
+        """Remove the points at the given coordinates tuples, if they exist."""
+        for coordinates in coordinates_list:
+            if coordinates not in self._dict:
+                continue
+            if self._has_aggregates:
+                self._update_aggregates(coordinates, self._dict[coordinates],
+                                       self._dict.default_factory())
+            del self._dict[coordinates]
+            del self._sequence[coordinates]
+            for i, (index, coordinate) in enumerate(zip(self._index, coordinates)):
+                points = index[coordinate]
+                points.discard(coordinates)
+                if not points:
+                    del index[coordinate]
+                    self._sorted_coordinates[i] = None
+    
+    def _init_levels(self):
+        """Create the clouds holding the totals at the first level of each
+        axis that has levels. These clouds have the remaining levels of the
+        axis, so that each level is computed from the previous one.
+        """
+        self._levels = []
+        self._level_clouds = {}
+        self._finer_levels = {}
+        for i, axis in enumerate(self.axes):
+            if not axis.levels:
+                continue
+            (name, function), coarser_levels = axis.levels[0], axis.levels[1:]
+            axes = list(self.axes)
+            axes[i] = Axis(name, levels=coarser_levels)
+            cloud = DataPointsCloud(axes, self._dict.default_factory)
+            self._levels.append((i, function, cloud))
+            
+            finer_name = axis.name
+            for name, function in axis.levels:
+                self._level_clouds[name] = cloud
+                self._finer_levels[name] = (finer_name, function)
+                finer_name = name
+    
+    def _update_aggregates(self, coordinates, old_value, new_value):
+        delta = new_value - old_value
+        for indexes, totals in self._marginals.values():
+            totals[tuple(coordinates[i] for i in indexes)] += delta
+        for i, function, cloud in self._levels:
+            level_coordinates = coordinates[:i] + (function(coordinates[i]),) + coordinates[i + 1:]
+            cloud._set(level_coordinates, cloud._get(level_coordinates) + delta)
+            cloud.version += 1
+    
+    def _for_names(self, names):
+        """Return the cloud answering queries on the given axis or level names
+        (filters keywords are accepted too): this one, or the cloud holding
+        the totals at a level of one of the axes.
+        """
+        for name in names:
+            axis_name = self._split_lookup(name)[0]
+            if axis_name not in self._axis_indexes and axis_name in self._level_clouds:
+                cloud = self._level_clouds[axis_name]
+                for other_name in names:
+                    other_axis_name = self._split_lookup(other_name)[0]
+                    if (other_axis_name in self._axis_indexes
+                            and other_axis_name not in cloud._axis_indexes):
+                        raise ValueError("Can't filter on both %r and its level %r."
+                                         % (other_axis_name, axis_name))
+                return cloud._for_names(names)
+        return self
+    
+    def drill_down(self, level, value, **filters):
+        """Return the totals of the points matching the filters at the level
+        just below the given one, for the coordinates that belong to `value`
+        (eg: the totals of each month of a given quarter), as a sorted list of
+        (coordinate, total) tuples.
+        """
+        finer_name, function = self._finer_levels[level]
+        totals = self._for_names([finer_name] + list(filters))._totals_by(finer_name, filters)
+        return _sorted_if_possible((coordinate, total) for coordinate, total in totals.items()
+                                   if function(coordinate) == value)
+    
+    def _marginal_total(self, filters):
+        """Return the total of the points matching the filters if it's
+        materialized, or None otherwise.
+        """
+        if not self._marginals or any('__' in key for key in filters):
+            return None
+        try:
+            indexes, totals = self._marginals[frozenset(filters)]
+        except KeyError:
+            return None
+        names = [self.axes[i].name for i in indexes]
+        return totals.get(tuple(filters[name] for name in names), 0)
+    
+    def group_by(self, *axis_names, **kwargs):
+        """Return a new cloud projected onto the given axes, the values of the
+        points that end up together being folded with a combine function
+        (a keyword argument that defaults to addition).
+        """
+        combine = kwargs.pop('combine', add)
+        indexes = [self.get_axis_index(name) for name in axis_names]
+        cloud = self._group_by_cloud([self.axes[i] for i in indexes], **kwargs)
+        for coordinates, value in self.points():
+            projected = tuple(coordinates[i] for i in indexes)
+            cloud._set(projected, combine(cloud._get(projected), value))
+        return cloud
+    
+    def _group_by_cloud(self, axes, **kwargs):
+        """Return the empty cloud that group_by() fills."""
+        return self.__class__(axes, self._dict.default_factory, **kwargs)
     
     def points_at(self, **filters):
         """Return points matching the criteria given by the filters keywords.
         See note on XXX for the syntax of filters."""
-        filter_callback = lambda point: self.point_match_filters(point, filters)
-        return filter(filter_callback, self.points())
+        cloud = self._for_names(filters)
+        if cloud is not self:
+            return cloud.points_at(**filters)
+        return self._points_at(filters)
+    
+    def _points_at(self, filters):
+        return [(coordinates, self._dict[coordinates])
+                for coordinates in self._match(filters)]
+    
+    def _plan(self, filters):
+        """Return the list of (filter keyword, axis index, lookup) tuples
+        for the given filters.
+        Plans are compiled once per set of filter keywords and cached.
+        """
+        signature = tuple(sorted(filters))
+        try:
+            return self._plans[signature]
+        except KeyError:
+            pass
+        
+        plan = []
+        for key in signature:
+            axis_name, lookup = self._split_lookup(key)
+            if axis_name not in self._axis_indexes:
+                raise ValueError("Unknown axis %r in filter %r." % (axis_name, key))
+            if lookup not in self.available_axis_lookups:
+                raise ValueError("Unknown lookup %r in filter %r." % (lookup, key))
+            plan.append((key, self.get_axis_index(axis_name), lookup))
+        self._plans[signature] = plan
+        return plan
+    
+    def _match(self, filters):
+        """Return the coordinates of all points matching the filters.
+        "equals" and "in" lookups are resolved with the inverted indexes,
+        range lookups by bisecting the sorted coordinates of the axis and
+        other lookups are tested on the remaining candidates one by one.
+        Points are returned in the order they were loaded.
+        """
+        matching_sets = []
+        remaining = []
+        for key, i, lookup in self._plan(filters):
+            filter_value = filters[key]
+            index = self._index[i]
+            if lookup == 'equals':
+                matching_sets.append(_lookup(index, filter_value, set()))
+            elif lookup == 'in':
+                matching_sets.append(set().union(*(_lookup(index, v, ()) for v in filter_value)))
+            elif lookup in self.range_axis_lookups:
+                keys = self._sorted_axis_coordinates(i)
+                keys = keys[self.range_axis_lookups[lookup](filter_value, keys)]
+                matching_sets.append(set().union(*(index[k] for k in keys)))
+            else:
+                test_callback = self.available_axis_lookups[lookup]
+                remaining.append((i, test_callback, filter_value))
+        
+        if matching_sets:
+            matching_sets.sort(key=len)
+            candidates = matching_sets[0].intersection(*matching_sets[1:])
+            # Sets have no meaningful order: return points in load order.
+            candidates = sorted(candidates, key=self._sequence.__getitem__)
+        else:
+            candidates = self._dict.keys()
+        
+        if not remaining:
+            return candidates
+        return [coordinates for coordinates in candidates
+                if all(test_callback(filter_value, coordinates[i])
+                       for i, test_callback, filter_value in remaining)]
+    
+    def _sorted_axis_coordinates(self, i):
+        """Return the sorted list of the coordinates of the points on the
+        axis with the given index. It's only sorted again when new
+        coordinates were added to the axis.
+        """
+        if self._sorted_coordinates[i] is None:
+            self._sorted_coordinates[i] = sorted(self._index[i])
+        return self._sorted_coordinates[i]
     
     def values_at(self, **filters):
         """A simple wrapper around self.points_at() to return only the values.
         """
-        return [p[1] for p in self.points_at(**filters)]
+        cloud = self._for_names(filters)
+        if cloud is not self:
+            return cloud.values_at(**filters)
+        return list(self._cached('values_at', filters, self._values_at))
+    
+    def _values_at(self, filters):
+        return tuple(p[1] for p in self._points_at(filters))
     
     def sum_(self, **filters):
         """A utility method to sum values of points matching a criteria."""
-        return sum(self.values_at(**filters))
+        cloud = self._for_names(filters)
+        if cloud is not self:
+            return cloud.sum_(**filters)
+        total = self._marginal_total(filters)
+        if total is not None:
+            return total
+        return self._cached('sum_', filters, self._sum)
+    
+    def _sum(self, filters):
+        return sum(self._values_at(filters))
+    
+    def _cached(self, method, filters, compute):
+        """Return compute(filters), caching the result with the given method
+        name and the filters as a key.
+        Values of "in" filters are compared as sets and lists are compared as
+        tuples; results for unhashable filters values aren't cached.
+        """
+        if self._cache_version != self.version:
+            self._cache.clear()
+            self._cache_version = self.version
+        
+        try:
+            key = (method, frozenset((k, _cache_key_value(k, v)) for k, v in filters.items()))
+            result = self._cache.pop(key)
+        except TypeError: # Unhashable filter value
+            return compute(filters)
+        except KeyError:
+            self._cache_misses += 1
+            result = compute(filters)
+            if self.cache_size <= 0:
+                return result
+            while len(self._cache) >= self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache_hits += 1
+        self._cache[key] = result
+        return result
+    
+    def cache_info(self):
+        """Return statistics about the result cache, like functools.lru_cache."""
+        return CacheInfo(self._cache_hits, self._cache_misses, self.cache_size, len(self._cache))
+    
+    def pivot(self, rows, cols, **filters):
+        """Return a Pivot table of the sums of the values of the points
+        matching the filters, along the `rows` and `cols` axes.
+        The table and its totals are all computed in a single pass.
+        """
+        cloud = self._for_names([rows, cols] + list(filters))
+        if cloud is not self:
+            return cloud.pivot(rows, cols, **filters)
+        row_index, col_index = self.get_axis_index(rows), self.get_axis_index(cols)
+        cells = defaultdict(int)
+        row_totals = defaultdict(int)
+        col_totals = defaultdict(int)
+        total = 0
+        for coordinates, value in self._points_at(filters):
+            row, col = coordinates[row_index], coordinates[col_index]
+            cells[row, col] += value
+            row_totals[row] += value
+            col_totals[col] += value
+            total += value
+        return Pivot(cells, row_totals, col_totals, total, self._dict.default_factory())
+    
+    def top(self, n, by_axis, **filters):
+        """Return the n coordinates of the by_axis axis with the highest
+        totals over the points matching the filters, as a list of
+        (coordinate, total) tuples sorted by decreasing total.
+        """
+        totals = self._for_names([by_axis] + list(filters))._totals_by(by_axis, filters)
+        return heapq.nlargest(n, totals.items(), key=itemgetter(1))
+    
+    def ranked(self, by_axis, **filters):
+        """Return all the coordinates of the by_axis axis, ranked by their
+        totals over the points matching the filters, as a list of
+        (rank, coordinate, total) tuples. Equal totals share the same rank.
+        """
+        totals = self._for_names([by_axis] + list(filters))._totals_by(by_axis, filters)
+        totals = sorted(totals.items(),
+                        key=itemgetter(1), reverse=True)
+        ranked = []
+        for position, (coordinate, total) in enumerate(totals, 1):
+            if ranked and ranked[-1][2] == total:
+                position = ranked[-1][0]
+            ranked.append((position, coordinate, total))
+        return ranked
+    
+    def _totals_by(self, axis_name, filters):
+        """Return a dict of the totals of the points matching the filters for
+        each coordinate of the given axis. It's read from the marginals
+        directly when they include these totals and there are no filters.
+        """
+        if not filters and frozenset([axis_name]) in self._marginals:
+            indexes, totals = self._marginals[frozenset([axis_name])]
+            return dict((key[0], total) for key, total in totals.items())
+        
+        i = self.get_axis_index(axis_name)
+        totals = defaultdict(int)
+        for coordinates, value in self._points_at(filters):
+            totals[coordinates[i]] += value
+        return totals
     
     def point_match_filters(self, point, filters):
         """Return whether the given point matches the criteria specified by the filters keywords.
@@ -122,11 +832,7 @@ class DataPointsCloud(object):
     def test_for_axis(self, coordinates, axis_name, filter_value):
         """
         """
-        if '__' in axis_name:
-            axis_name, lookup = axis_name.split('__')
-        else:
-            lookup = 'equals'
-        
+        axis_name, lookup = self._split_lookup(axis_name)
         actual_value = coordinates[self.get_axis_index(axis_name)]
         try:
             test_callback = self.available_axis_lookups[lookup]
@@ -134,3 +840,483 @@ class DataPointsCloud(object):
             return False # TODO: Better exception handling
         else:
             return test_callback(filter_value, actual_value)
+    
+    def _split_lookup(self, key):
+        """Split a filter keyword into an (axis name, lookup) tuple."""
+        if '__' in key:
+            return key.split('__')
+        return key, 'equals'
+
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize')
+
+SNAPSHOT_MAGIC = b'DPCLOUD1'
+
+
+def _pack_codes(codes, widths):
+    """Pack integer codes into a single integer, using the given number of
+    bits for each of them (the first code being the most significant one).
+    """
+    key = 0
+    for code, width in zip(codes, widths):
+        key = (key << width) | code
+    return key
+
+
+def _unpack_codes(key, widths):
+    """The inverse of _pack_codes()."""
+    codes = []
+    for width in reversed(widths):
+        codes.append(key & ((1 << width) - 1))
+        key >>= width
+    return tuple(reversed(codes))
+
+
+def _cache_key_value(key, value):
+    """Return a hashable version of a filter value, for the result cache."""
+    if key.endswith('__in'):
+        return frozenset(value)
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def _lookup(mapping, key, default=None):
+    """Like mapping.get(key, default), but unhashable keys (which can't be
+    coordinates) are missing instead of raising TypeError.
+    """
+    try:
+        return mapping.get(key, default)
+    except TypeError:
+        return default
+
+
+def _constant(value):
+    return value
+
+
+def _replace_point(row, current):
+    return row
+
+
+def _keep_other(value, other):
+    return other
+
+
+def _chunks(iterable, size):
+    """Split an iterable into lists of (at most) size items."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def _load_partial_cloud(task):
+    """Load a chunk of rows into a new cloud and return its points.
+    Used by DataPointsCloud.load_data_parallel() in worker processes.
+    """
+    axes, default_factory, make_point, rows = task
+    cloud = DataPointsCloud(axes, default_factory)
+    cloud.load_data(rows, make_point)
+    return list(cloud.points())
+
+
+class Pivot(object):
+    """A two-dimensional table of totals, as returned by DataPointsCloud.pivot().
+        * cols is the list of column coordinates.
+        * rows is a list of (row coordinate, cells, row total) tuples, where
+            cells is the list of values for each column.
+        * col_totals is the list of totals for each column.
+        * total is the grand total.
+    Empty cells contain the default value of the cloud.
+    """
+    def __init__(self, cells, row_totals, col_totals, total, default=None):
+        self.cols = _sorted_if_possible(col_totals)
+        self.rows = [(row, [cells.get((row, col), default) for col in self.cols], row_totals[row])
+                     for row in _sorted_if_possible(row_totals)]
+        self.col_totals = [col_totals[col] for col in self.cols]
+        self.total = total
+
+
+def _sorted_if_possible(iterable):
+    """Return a sorted list of the items of the iterable, or an unsorted one
+    if they can't be compared.
+    """
+    items = list(iterable)
+    try:
+        return sorted(items)
+    except TypeError:
+        return items
+
+
+def _python_value(value):
+    """Convert a value read from a numpy array to a Python value. Values of
+    arrays of objects already are Python values.
+    """
+    if numpy is not None and isinstance(value, numpy.generic):
+        return value.item()
+    return value
+
+
+def _fits_dtype(value, dtype):
+    """Return whether the value can be stored in an array of the given dtype
+    and read back unchanged.
+    """
+    if dtype.kind == 'i':
+        return (isinstance(value, (int, numpy.integer)) and not isinstance(value, bool)
+                and -2 ** 63 <= value < 2 ** 63)
+    if dtype.kind == 'f':
+        return isinstance(value, (float, numpy.floating))
+    return True
+
+
+class ArrayDataPointsCloud(DataPointsCloud):
+    """A DataPointsCloud that stores its values in a dense N-dimensional numpy
+    array instead of a dict, each axis being dictionary-encoded.
+    This is well suited for dense clouds of numbers: sum_(), values_at() and
+    value_at() are answered with array slices and reductions.
+    
+    The value returned by default_factory is used to fill the array. Unless
+    a dtype is given, the array holds integers or floats when that value is
+    an int or a float, and Python objects otherwise (eg: a None default, or
+    Decimal values that must stay exact). When a value that doesn't fit
+    arrives (a float or a Decimal in an array of integers for example), the
+    array is converted to an array of objects rather than truncating it.
+    """
+    def __init__(self, axes=None, default_factory=None, marginals=(), dtype=None):
+        if numpy is None:
+            raise ImportError("ArrayDataPointsCloud requires numpy.")
+        super(ArrayDataPointsCloud, self).__init__(axes, default_factory, marginals)
+        
+        self._fill_value = self._dict.default_factory()
+        self._infer_dtype = dtype is None
+        if dtype is None:
+            if isinstance(self._fill_value, bool):
+                dtype = object
+            elif isinstance(self._fill_value, int):
+                dtype = numpy.int64
+            elif isinstance(self._fill_value, float):
+                dtype = float
+            else:
+                dtype = object
+        self._vocabularies = [_Vocabulary() for axis in self.axes]
+        shape = tuple(0 for axis in self.axes)
+        self._array = numpy.full(shape, self._fill_value, dtype=dtype)
+        self._present = numpy.zeros(shape, dtype=bool)
+    
+    def points(self, iterable=False):
+        points = self._points_for(self._select({}))
+        return iterable and iter(points) or points
+    
+    def _get(self, coordinates):
+        codes = tuple(vocabulary.code_of(c)
+                      for vocabulary, c in zip(self._vocabularies, coordinates))
+        if None in codes or any(c >= size for c, size in zip(codes, self._array.shape)):
+            return self._dict.default_factory()
+        return _python_value(self._array[codes])
+    
+    def _set(self, coordinates, value):
+        if self._has_aggregates:
+            self._update_aggregates(coordinates, self._get(coordinates), value)
+        codes = tuple(vocabulary.encode(c)
+                      for vocabulary, c in zip(self._vocabularies, coordinates))
+        self._grow(codes)
+        if self._infer_dtype and not _fits_dtype(value, self._array.dtype):
+            self._array = self._array.astype(object)
+        self._array[codes] = value
+        self._present[codes] = True
+    
+    def _delete(self, coordinates_list):
+        for coordinates in coordinates_list:
+            codes = tuple(vocabulary.code_of(c)
+                          for vocabulary, c in zip(self._vocabularies, coordinates))
+            if None in codes or any(c >= size for c, size in zip(codes, self._array.shape)):
+                continue
+            if self._has_aggregates and self._present[codes]:
+                self._update_aggregates(coordinates, _python_value(self._array[codes]),
+                                       self._fill_value)
+            self._array[codes] = self._fill_value
+            self._present[codes] = False
+    
+    def _grow(self, codes):
+        """Make sure the array is big enough to hold the given codes.
+        The size of an axis is doubled whenever it is too small, so that
+        loading data doesn't reallocate the array for each new coordinate.
+        """
+        shape = self._array.shape
+        if all(c < size for c, size in zip(codes, shape)):
+            return
+        new_shape = tuple(size if c < size else max(c + 1, 2 * size)
+                          for c, size in zip(codes, shape))
+        old = tuple(slice(0, size) for size in shape)
+        values, present = self._array, self._present
+        self._array = numpy.full(new_shape, self._fill_value, dtype=values.dtype)
+        self._array[old] = values
+        self._present = numpy.zeros(new_shape, dtype=bool)
+        self._present[old] = present
+    
+    def _select(self, filters):
+        """Return a (codes, values, present) tuple for the slice of the cloud
+        matching the filters, where codes is a list containing the array of
+        selected codes for each axis.
+        Lookups are tested once per coordinate of the vocabulary of the axis
+        instead of once per point.
+        """
+        codes = [numpy.arange(size) for size in self._array.shape]
+        for key, i, lookup in self._plan(filters):
+            filter_value = filters[key]
+            vocabulary = self._vocabularies[i]
+            if lookup == 'equals':
+                selected = [vocabulary.code_of(filter_value)]
+            elif lookup == 'in':
+                selected = [vocabulary.code_of(v) for v in filter_value]
+            else:
+                test_callback = self.available_axis_lookups[lookup]
+                selected = [code for code in codes[i] if code < len(vocabulary)
+                            and test_callback(filter_value, vocabulary.decode(code))]
+            selected = numpy.array([c for c in selected if c is not None], dtype=int)
+            codes[i] = numpy.intersect1d(codes[i], selected)
+        
+        values, present = self._array, self._present
+        for i, selected in enumerate(codes):
+            values = values.take(selected, axis=i)
+            present = present.take(selected, axis=i)
+        return codes, values, present
+    
+    def _points_for(self, selection):
+        codes, values, present = selection
+        points = []
+        for position in zip(*numpy.nonzero(present)):
+            coordinates = tuple(vocabulary.decode(c[p])
+                                for vocabulary, c, p in zip(self._vocabularies, codes, position))
+            points.append((coordinates, _python_value(values[position])))
+        return points
+    
+    def _points_at(self, filters):
+        return self._points_for(self._select(filters))
+    
+    def _values_at(self, filters):
+        codes, values, present = self._select(filters)
+        return tuple(values[present].tolist())
+    
+    def _sum(self, filters):
+        codes, values, present = self._select(filters)
+        return _python_value(values[present].sum())
+
+
+class CompactDataPointsCloud(DataPointsCloud):
+    """A DataPointsCloud storing sparse points compactly.
+    
+    The coordinates of each point are dictionary-encoded by the axes and
+    packed into a single 64-bit integer key, and values
+    are stored in a typed array. Keys are kept sorted to look points up by
+    bisection, new points being buffered in a small dict until there are
+    buffer_size of them. This uses around 16 bytes per point instead of a
+    tuple of coordinates and a dict entry.
+    
+    Filters are answered by a scan over the keys, testing lookups once per
+    coordinate of the vocabulary of each axis.
+    """
+    buffer_size = 65536
+    
+    # The typecode of the array of values: 'q' for integers and 'd' for
+    # floats. By default, it's inferred from the first value stored, and
+    # only int and float values are accepted. With typecode='d', any number
+    # can be stored but it's converted to a float (Decimal values included).
+    typecode = None
+    
+    def __init__(self, axes=None, default_factory=None, marginals=(), typecode=None):
+        super(CompactDataPointsCloud, self).__init__(axes, default_factory, marginals)
+        if typecode is not None:
+            self.typecode = typecode
+        self._keys = array('q')
+        self._values = array(self.typecode or 'q')
+        self._pending = {}
+        self._vocabularies = [_Vocabulary() for axis in self.axes]
+        # The number of bits of the code of each axis in the keys, which
+        # grows with the vocabularies.
+        self._widths = [0 for axis in self.axes]
+    
+    def _decode(self, key):
+        codes = _unpack_codes(key, self._widths)
+        return tuple(vocabulary.decode(code)
+                     for vocabulary, code in zip(self._vocabularies, codes))
+    
+    def points(self, iterable=False):
+        self._flush()
+        points = ((self._decode(key), value) for key, value in zip(self._keys, self._values))
+        return iterable and points or list(points)
+    
+    def _find(self, key):
+        """Return the position of the given key in the sorted keys, or None."""
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return i
+        return None
+    
+    def _get(self, coordinates):
+        codes = tuple(vocabulary.code_of(c)
+                      for vocabulary, c in zip(self._vocabularies, coordinates))
+        if None not in codes and all(c >> w == 0 for c, w in zip(codes, self._widths)):
+            key = _pack_codes(codes, self._widths)
+            if key in self._pending:
+                return self._pending[key]
+            i = self._find(key)
+            if i is not None:
+                return self._values[i]
+        return self._dict.default_factory()
+    
+    def _set(self, coordinates, value):
+        if self.typecode is None:
+            if isinstance(value, int):
+                self.typecode = 'q'
+            elif isinstance(value, float):
+                self.typecode = 'd'
+            else:
+                raise TypeError("%s only stores int and float values, got %r "
+                                "(pass typecode='d' to store it as a float)."
+                                % (self.__class__.__name__, value))
+            self._values = array(self.typecode)
+        elif self.typecode == 'q' and not isinstance(value, int):
+            raise TypeError("%r can't be stored in a cloud of integers "
+                            "(pass typecode='d' to store floats)." % (value,))
+        if self._has_aggregates:
+            self._update_aggregates(coordinates, self._get(coordinates), value)
+        codes = tuple(vocabulary.encode(c)
+                      for vocabulary, c in zip(self._vocabularies, coordinates))
+        if any(c >> w for c, w in zip(codes, self._widths)):
+            self._widen([max(w, c.bit_length()) for c, w in zip(codes, self._widths)])
+        key = _pack_codes(codes, self._widths)
+        i = self._find(key)
+        if i is not None:
+            self._values[i] = value
+            return
+        self._pending[key] = value
+        if len(self._pending) >= self.buffer_size:
+            self._flush()
+    
+    def _widen(self, widths):
+        """Pack the keys with the given (larger) widths. Keys are packed with
+        the code of the first axis as the most significant bits, so they
+        stay sorted.
+        """
+        if sum(widths) > 63:
+            raise ValueError("Too many distinct coordinates to pack keys in 64 bits.")
+        repack = lambda key: _pack_codes(_unpack_codes(key, self._widths), widths)
+        self._keys = array('q', [repack(key) for key in self._keys])
+        self._pending = dict((repack(key), value) for key, value in self._pending.items())
+        self._widths = widths
+    
+    def _flush(self):
+        """Merge the buffered new points into the sorted arrays."""
+        if not self._pending:
+            return
+        keys, values = array('q'), array(self.typecode)
+        pending = sorted(self._pending.items())
+        for key, value in heapq.merge(zip(self._keys, self._values), pending):
+            keys.append(key)
+            values.append(value)
+        self._keys, self._values = keys, values
+        self._pending = {}
+    
+    def _delete(self, coordinates_list):
+        self._flush()
+        removed = set()
+        for coordinates in coordinates_list:
+            codes = tuple(vocabulary.code_of(c)
+                          for vocabulary, c in zip(self._vocabularies, coordinates))
+            if None in codes or any(c >> w for c, w in zip(codes, self._widths)):
+                continue
+            i = self._find(_pack_codes(codes, self._widths))
+            if i is None:
+                continue
+            if self._has_aggregates:
+                self._update_aggregates(coordinates, self._values[i],
+                                       self._dict.default_factory())
+            removed.add(i)
+        
+        if removed:
+            self._keys = array('q', (key for i, key in enumerate(self._keys)
+                                     if i not in removed))
+            self._values = array(self.typecode, (value for i, value in enumerate(self._values)
+                                                         if i not in removed))
+    
+    def _points_at(self, filters):
+        return [(self._decode(self._keys[i]), self._values[i]) for i in self._match(filters)]
+    
+    def _match(self, filters):
+        """Return the positions of the points matching the filters."""
+        self._flush()
+        tests = []
+        shift = 0
+        shifts = []
+        for width in reversed(self._widths):
+            shifts.insert(0, shift)
+            shift += width
+        
+        for key, i, lookup in self._plan(filters):
+            filter_value = filters[key]
+            vocabulary = self._vocabularies[i]
+            if lookup == 'equals':
+                codes = set([vocabulary.code_of(filter_value)])
+            elif lookup == 'in':
+                codes = set(vocabulary.code_of(v) for v in filter_value)
+            else:
+                test_callback = self.available_axis_lookups[lookup]
+                codes = set(code for code, c in enumerate(vocabulary.coordinates)
+                            if test_callback(filter_value, c))
+            tests.append((shifts[i], (1 << self._widths[i]) - 1, codes))
+        
+        return [i for i, key in enumerate(self._keys)
+                if all((key >> shift) & mask in codes for shift, mask, codes in tests)]
+
+
+class MappedDataPointsCloud(CompactDataPointsCloud):
+    """A read-only DataPointsCloud backed by a memory-mapped snapshot file
+    (see DataPointsCloud.dump() and DataPointsCloud.open()).
+    Keys and values are laid out in the file the same way as in memory for
+    a CompactDataPointsCloud.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        if self._mmap[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError("%s is not a DataPointsCloud snapshot." % path)
+        offset = len(SNAPSHOT_MAGIC)
+        header_length, = struct.unpack_from('<Q', self._mmap, offset)
+        offset += 8
+        header = pickle.loads(self._mmap[offset:offset + header_length])
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError("%s was written on a machine with a different byte order." % path)
+        offset += header_length
+        offset += -offset % 8
+        
+        axes = [Axis(name) for name in header['axes']]
+        super(MappedDataPointsCloud, self).__init__(axes, header['default'],
+                                                    typecode=header['typecode'])
+        self._vocabularies = [_Vocabulary(coordinates) for coordinates in header['vocabularies']]
+        
+        count = header['count']
+        buffer = memoryview(self._mmap)
+        self._keys = buffer[offset:offset + 8 * count].cast('q')
+        offset += 8 * count
+        self._values = buffer[offset:offset + 8 * count].cast(header['typecode'])
+        self._widths = header['widths']
+    
+    def close(self):
+        """Release the memory-mapped file."""
+        self._keys.release()
+        self._values.release()
+        self._mmap.close()
+    
+    def _group_by_cloud(self, axes, **kwargs):
+        kwargs.setdefault('typecode', self.typecode)
+        return CompactDataPointsCloud(axes, self._dict.default_factory, **kwargs)
+    
+    def _set(self, coordinates, value):
+        raise TypeError("Snapshot clouds are read-only.")
+    
+    def _delete(self, coordinates_list):
+        raise TypeError("Snapshot clouds are read-only.")
@@ -1,19 +1,73 @@
+import asyncio
+import base64
+from collections import deque, namedtuple
+from copy import copy
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from email.mime.base import MIMEBase
+from functools import lru_cache
+from itertools import islice
+import mimetypes
+import mmap
+import os
+import re
+
+from urllib.parse import urljoin, urlsplit
+
+import django
+
+from django.conf import settings
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import EmailMessage
-from django.template import engines
+from django.core.mail import EmailMessage, get_connection
+from django.template import Node, Variable, engines
+from django.template.backends.django import Template as DjangoTemplate
 from django.template.loader import get_template
+from django.test.signals import setting_changed
+
+from toolbox.mailpool import get_pool
+from toolbox.scheduler import DomainScheduler
+from toolbox.spool import get_spool
+try: # django >= 2.2
+    from django.utils.autoreload import file_changed
+except ImportError:
+    file_changed = None
 
 SINGLELINE = 1
 MULTILINE = 2
 LIST = 3
 
+# The result of sending one message with EmailTemplate.send_mass().
+SendResult = namedtuple('SendResult', 'recipients sent error')
+
+# Compiled templates cached on EmailTemplate classes are only valid for
+# the current generation, which changes whenever template loaders may have
+# been reset (templates settings changed in tests, or files changed while
+# the autoreloader runs).
+_template_cache_generation = 0
+
+
+def _reset_template_cache(**kwargs):
+    global _template_cache_generation
+    _template_cache_generation += 1
+
+
+def _templates_setting_changed(setting, **kwargs):
+    if setting == 'TEMPLATES':
+        _reset_template_cache()
+
+
+setting_changed.connect(_templates_setting_changed)
+if file_changed is not None:
+    file_changed.connect(_reset_template_cache)
+
 
 class EmailTemplate(object):
     """
     A declarative style email template.
     
     It supports the same fields as django.core.mail.EmailMessage:
-        subject, body, from_email, to, cc, bcc, headers.
+        subject, body, from_email, to, cc, bcc, headers, attachments.
+    Attachments are given as paths of files, whose base64 encoding is cached
+    and shared by all the messages attaching the same file.
     
     Each field can be specified in three different ways:
         1. As an attribute on the class for static values.
@@ -26,8 +80,10 @@ class EmailTemplate(object):
     
     For more complex worflows, subclasses can extend the render_%s methods.
     
+    Templates are compiled on first use only and cached on the class.
+    
     Also note that some fields accept both a value (or a template)
-    or a list of them: to, cc, bcc and headers.
+    or a list of them: to, cc, bcc, headers and attachments.
     
     
     Example:
@@ -43,6 +99,10 @@ class EmailTemplate(object):
         body_template_name = 'myapp/welcome_email.txt'
     """
     message_class = EmailMessage
+    # Send messages over the connections of toolbox.mailpool instead of
+    # opening a connection for each of them.
+    use_connection_pool = True
+    fields = ('subject', 'body', 'from_email', 'to', 'cc', 'bcc', 'headers', 'attachments')
     
     def get_message_class(self, context):
         return self.message_class
@@ -57,14 +117,209 @@ class EmailTemplate(object):
         if request is not None:
             context['site'] = get_current_site(request)
         
-        message_class = self.get_message_class(context)
-        return message_class(**self._render_kwargs(context))
+        return self._make_message(context, self._render_kwargs(context))
+
+    def prepare(self, shared_context=None, request=None):
+        """
+        Return a PreparedEmailTemplate rendering messages that share the given
+        context (a campaign for example): the fields that only depend on the
+        shared context are rendered once, the others for each message.
+        """
+        if shared_context is None:
+            shared_context = {}
+        
+        if request is not None:
+            shared_context['site'] = get_current_site(request)
+        
+        return PreparedEmailTemplate(self, shared_context)
 
     @classmethod
     def send_immediately(cls, **context):
         tpl = cls()
         msg = tpl.render(context)
-        return msg.send()
+        if not cls.use_connection_pool:
+            return msg.send()
+        if not msg.recipients():
+            return 0
+        return get_pool().send_messages([msg])
+
+    @classmethod
+    def queue(cls, **context):
+        """
+        Like send_immediately(), but the message is only written to the
+        email spool (see toolbox.spool), to be sent by the
+        send_spooled_mail management command.
+        """
+        tpl = cls()
+        msg = tpl.render(context)
+        return get_spool().put(msg)
+
+    @classmethod
+    def send_mass(cls, contexts, batch_size=100, connection=None):
+        """
+        Render and send a message for each context of the given iterable,
+        over a single connection to the email backend.
+        
+        Messages are rendered lazily, batch_size at a time. Each message is
+        sent with the connection's send_messages() so that a failure only
+        affects its own message: the connection is closed after a failure,
+        to be reopened for the next message.
+        Return a list of SendResult(recipients, sent, error), in order.
+        The recipients of messages that couldn't be rendered are None.
+        """
+        if connection is None:
+            connection = get_connection()
+        
+        tpl = cls()
+        contexts = iter(contexts)
+        results = []
+        opened = connection.open()
+        try:
+            while True:
+                batch = []
+                for context in islice(contexts, batch_size):
+                    try:
+                        batch.append((tpl.render(context), None))
+                    except Exception as e:
+                        batch.append((None, e))
+                if not batch:
+                    break
+                for msg, error in batch:
+                    if error is not None:
+                        results.append(SendResult(None, False, error))
+                        continue
+                    try:
+                        # Reopen the connection if it was closed after a failure.
+                        if connection.open():
+                            opened = True
+                        sent = connection.send_messages([msg])
+                    except Exception as e:
+                        results.append(SendResult(msg.recipients(), False, e))
+                        try:
+                            connection.close()
+                        except Exception:
+                            pass
+                    else:
+                        results.append(SendResult(msg.recipients(), bool(sent), None))
+        finally:
+            if opened:
+                connection.close()
+        return results
+
+    @classmethod
+    def send_scheduled(cls, contexts, **options):
+        """
+        Render a message for each context of the given iterable and send them
+        with a DomainScheduler created with the given options, which
+        rate limits sends by recipient domain.
+        Return the scheduler, which holds the statistics of each domain and
+        the messages that couldn't be sent.
+        """
+        scheduler = DomainScheduler(**options)
+        tpl = cls()
+        for context in contexts:
+            scheduler.add(tpl.render(context))
+        scheduler.run()
+        return scheduler
+
+    @classmethod
+    async def asend(cls, **context):
+        """
+        Like send_immediately(), but the message is sent with the asyncio
+        SMTP client aiosmtplib (which must be installed), using the
+        EMAIL_* settings of django's SMTP backend.
+        """
+        tpl = cls()
+        msg = tpl.render(context)
+        if not msg.recipients():
+            return 0
+        
+        async with _smtp_client() as smtp:
+            await _asend_message(smtp, msg)
+        return 1
+
+    @classmethod
+    async def asend_mass(cls, contexts, concurrency=10, hostname=None, port=None,
+                         **smtp_options):
+        """
+        The asyncio counterpart of send_mass(): render and send a message for
+        each context of the given iterable with aiosmtplib.
+        
+        At most concurrency messages are sent at once, each over its own SMTP
+        connection which is reused for the following messages. hostname,
+        port and other aiosmtplib.SMTP() options override the EMAIL_* settings.
+        Return a list of SendResult(recipients, sent, error), in order.
+        """
+        tpl = cls()
+        contexts = enumerate(contexts)
+        results = {}
+        
+        async def worker():
+            smtp = _smtp_client(hostname, port, **smtp_options)
+            try:
+                # Contexts are shared by the workers, which take the next one
+                # whenever they're done with a message.
+                for index, context in contexts:
+                    msg = tpl.render(context)
+                    try:
+                        if not smtp.is_connected:
+                            await smtp.connect()
+                        await _asend_message(smtp, msg)
+                    except Exception as e:
+                        results[index] = SendResult(msg.recipients(), False, e)
+                    else:
+                        results[index] = SendResult(msg.recipients(), bool(msg.recipients()), None)
+            finally:
+                if smtp.is_connected:
+                    try:
+                        await smtp.quit()
+                    except Exception:
+                        smtp.close()
+        
+        await asyncio.gather(*[worker() for i in range(concurrency)])
+        return [results[index] for index in range(len(results))]
+
+    @classmethod
+    def render_many(cls, contexts, workers=None, ordered=True, chunk_size=50,
+                    max_in_flight=None):
+        """
+        Render a message for each context of the given iterable in a pool of
+        worker processes and yield them as they're ready: in the order of the
+        contexts if ordered is True, or as soon as they're rendered otherwise.
+        
+        Contexts are sent to the workers in chunks of chunk_size, at most
+        max_in_flight chunks (twice the number of workers by default) being
+        rendered at once so that memory use stays flat however many contexts
+        there are. Contexts and rendered messages must be picklable.
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if max_in_flight is None:
+            max_in_flight = 2 * workers
+        
+        contexts = iter(contexts)
+        pending = deque()
+        with ProcessPoolExecutor(workers, initializer=_init_render_worker) as executor:
+            def submit():
+                chunk = list(islice(contexts, chunk_size))
+                if chunk:
+                    pending.append(executor.submit(_render_chunk, cls, chunk))
+                return bool(chunk)
+            
+            while len(pending) < max_in_flight and submit():
+                pass
+            
+            while pending:
+                if ordered:
+                    future = pending.popleft()
+                else:
+                    done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                    future = done.pop()
+                    pending.remove(future)
+                messages = future.result()
+                submit()
+                for msg in messages:
+                    yield msg
 
     def render_subject(self, context):
         return self._render_attr('subject', context, SINGLELINE)
@@ -87,13 +342,40 @@ class EmailTemplate(object):
     def render_headers(self, context):
         return self._render_attr('headers', context, LIST)
     
+    def render_attachments(self, context):
+        paths = self._render_attr('attachments', context, LIST) or []
+        return [_file_attachment(path) for path in paths if path]
+    
     def _render_kwargs(self, context):
         """
         Return a dictionary of keyword arguments used to instanciate the email object.
         """
-        args = ['subject', 'body', 'from_email', 'to', 'cc', 'bcc', 'headers']
+        return dict((field, self._render_field(field, context)) for field in self.fields)
+    
+    def _render_field(self, field, context):
+        return getattr(self, 'render_%s' % field)(context)
+    
+    def _make_message(self, context, kwargs):
+        """
+        Instanciate the email object with the given rendered fields.
+        """
+        message_class = self.get_message_class(context)
+        return message_class(**kwargs)
+    
+    def _field_variables(self, field):
+        """
+        Return the set of names of context variables the given field depends
+        on, or None if that can't be known (when its render method was
+        overridden or its template can't be analysed).
+        """
+        method_name = 'render_%s' % field
+        if getattr(type(self), method_name) is not getattr(EmailTemplate, method_name, None):
+            return None
         
-        return dict((arg, getattr(self, 'render_%s' % arg)(context)) for arg in args)
+        value, is_template = self._fetch_attr(field)
+        if not is_template:
+            return set()
+        return _template_variables(value)
     
     def _render_attr(self, attr, context, field_type, strip=True):
         """
@@ -145,41 +427,415 @@ class EmailTemplate(object):
             getattr(self, attr, None),
         )
         
-        if template_name is not None:
-            return get_template(template_name), True
-            
-        if template is not None:
-            if not isinstance(template, str):
-                template = "\n".join(template)
-            return engines['django'].from_string(template), True
+        if template_name is not None or template is not None:
+            return self._get_compiled_template(attr, template_name, template), True
             
         if not isinstance(value, str) and value is not None:
             value = "\n".join(value)
         return value, False
+    
+    @classmethod
+    def _get_compiled_template(cls, attr, template_name, template):
+        """
+        Return the compiled template for the given attribute, as found by
+        _fetch_attr(), compiling it only if it's not cached on the class yet.
+        """
+        cache = cls._get_template_cache()
+        source = (template_name, template)
+        cached = cache.get(attr)
+        if cached is not None and cached[0] == source:
+            return cached[1]
+        
+        if template_name is not None:
+            compiled = get_template(template_name)
+        else:
+            if not isinstance(template, str):
+                template = "\n".join(template)
+            compiled = engines['django'].from_string(template)
+        cache[attr] = (source, compiled)
+        return compiled
+    
+    @classmethod
+    def _get_template_cache(cls):
+        """
+        Return the dict of compiled templates cached on the class.
+        """
+        cache = cls.__dict__.get('_compiled_templates')
+        if cache is None or cache[0] != _template_cache_generation:
+            cache = cls._compiled_templates = (_template_cache_generation, {})
+        return cache[1]
+
+
+class PreparedEmailTemplate(object):
+    """
+    An email template bound to a shared context, as returned by
+    EmailTemplate.prepare().
+    
+    Templates of the fields are analysed to find the context variables they
+    use: fields that only use variables of the shared context are rendered
+    once and for all, the others are rendered for each message. An invariant
+    field is rendered again for the messages whose context overrides one of
+    its variables.
+    """
+    def __init__(self, template, shared_context):
+        self.template = template
+        self.shared_context = shared_context
+        
+        self.invariant_fields = {}
+        self.varying_fields = []
+        # The variables of each invariant field.
+        self._variables = {}
+        for field in template.fields:
+            variables = template._field_variables(field)
+            if variables is not None and variables.issubset(shared_context):
+                self.invariant_fields[field] = template._render_field(field, dict(shared_context))
+                self._variables[field] = variables
+            else:
+                self.varying_fields.append(field)
+    
+    def render(self, context=None):
+        """
+        Instanciate an email message with the shared context updated with
+        the given one.
+        """
+        full_context = dict(self.shared_context)
+        if context is not None:
+            full_context.update(context)
+        
+        kwargs = {}
+        for field, value in self.invariant_fields.items():
+            if context and not self._variables[field].isdisjoint(context):
+                kwargs[field] = self.template._render_field(field, full_context)
+            else:
+                # Messages may modify their lists and dicts: don't share them.
+                kwargs[field] = copy(value)
+        for field in self.varying_fields:
+            kwargs[field] = self.template._render_field(field, full_context)
+        return self.template._make_message(full_context, kwargs)
+
+
+# Template nodes whose dependencies on the context can be found by looking
+# for the variables in their attributes.
+_ANALYSABLE_NODES = frozenset([
+    'TextNode', 'VariableNode', 'IfNode', 'ForNode', 'WithNode', 'CommentNode',
+    'SpacelessNode', 'CycleNode', 'FirstOfNode', 'NowNode', 'IfChangedNode',
+    'RegroupNode', 'VerbatimNode', 'WidthRatioNode', 'FilterNode',
+    'AutoEscapeControlNode', 'TemplateTagNode', 'LoadNode', 'BlockNode',
+])
+
+# Attributes of template objects that don't lead to variables.
+_IGNORED_TEMPLATE_ATTRIBUTES = frozenset(['origin', 'token', 'engine', 'loader'])
+
+
+def _template_variables(template):
+    """
+    Return the set of names of context variables used by the given compiled
+    template, or None if it uses tags that can't be analysed (includes,
+    custom tags, ...).
+    """
+    names = set()
+    seen = set()
+    nodelist = getattr(template, 'template', template).nodelist
+    for node in nodelist.get_nodes_by_type(Node):
+        if type(node).__name__ not in _ANALYSABLE_NODES:
+            return None
+        _collect_variables(node, names, seen)
+    names.discard('forloop')
+    return names
+
+
+def _collect_variables(obj, names, seen):
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+    
+    if isinstance(obj, Variable):
+        if obj.lookups:
+            names.add(obj.lookups[0])
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            _collect_variables(item, names, seen)
+    elif isinstance(obj, dict):
+        for item in obj.values():
+            _collect_variables(item, names, seen)
+    elif type(obj).__module__.startswith('django.template'):
+        attrs = set(getattr(obj, '__dict__', ()))
+        for cls in type(obj).__mro__:
+            attrs.update(getattr(cls, '__slots__', ()))
+        for attr in attrs - _IGNORED_TEMPLATE_ATTRIBUTES:
+            _collect_variables(getattr(obj, attr, None), names, seen)
+
+
+@lru_cache(maxsize=16)
+def _encoded_file(path, mtime, size):
+    """
+    Return the base64 encoding of the given file, which is memory mapped
+    rather than read. mtime and size are only part of the cache key, so
+    that a file is encoded again when it changes.
+    """
+    if not size: # Empty files can't be mapped
+        return ''
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return base64.encodebytes(data).decode('ascii')
+
+
+def _file_attachment(path):
+    """
+    Return a MIME part attaching the given file, with its payload already
+    encoded.
+    """
+    stat = os.stat(path)
+    content_type, encoding = mimetypes.guess_type(path)
+    if content_type is None or encoding is not None:
+        content_type = 'application/octet-stream'
+    
+    part = MIMEBase(*content_type.split('/', 1))
+    part.set_payload(_encoded_file(path, stat.st_mtime, stat.st_size))
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.add_header('Content-Disposition', 'attachment', filename=os.path.basename(path))
+    return part
+
+
+def _smtp_client(hostname=None, port=None, **options):
+    """
+    Return an aiosmtplib.SMTP client configured like django's SMTP backend.
+    """
+    import aiosmtplib
+    
+    kwargs = {
+        'hostname': hostname or settings.EMAIL_HOST,
+        'port': port or settings.EMAIL_PORT,
+        'username': settings.EMAIL_HOST_USER or None,
+        'password': settings.EMAIL_HOST_PASSWORD or None,
+        'use_tls': settings.EMAIL_USE_SSL,
+        'start_tls': settings.EMAIL_USE_TLS,
+        'timeout': settings.EMAIL_TIMEOUT,
+    }
+    kwargs.update(options)
+    return aiosmtplib.SMTP(**kwargs)
+
+
+async def _asend_message(smtp, msg):
+    recipients = msg.recipients()
+    if recipients:
+        await smtp.send_message(msg.message(), sender=msg.from_email,
+                                recipients=recipients)
+
+
+def _init_render_worker():
+    # Worker processes that weren't forked need django to be set up.
+    django.setup()
+
+
+def _render_chunk(template_class, contexts):
+    tpl = template_class()
+    return [tpl.render(context) for context in contexts]
+
+
+# Attributes holding links, as in lxml.html.
+LINK_ATTRIBUTES = (
+    'action', 'archive', 'background', 'cite', 'classid', 'codebase', 'data',
+    'dynsrc', 'href', 'longdesc', 'lowsrc', 'poster', 'profile', 'src', 'usemap',
+)
+
+_LINK_ATTRIBUTE_NAMES = frozenset(LINK_ATTRIBUTES)
+
+# An HTML start tag, whose attributes may contain quoted ">".
+_TAG_RE = re.compile(r"""<[a-zA-Z][^\s/>]*(?:"[^"]*"|'[^']*'|[^'">])*>""")
+
+# An attribute with a value, matched within a tag from left to right so that
+# the text of quoted values is never taken for another attribute.
+_ATTRIBUTE_RE = re.compile(
+    r"""(?P<prefix>(?P<name>[^\s"'>/=]+)\s*=\s*)(?:"(?P<dq>[^"]*)"|'(?P<sq>[^']*)'|(?P<uq>[^\s"'>]+))"""
+)
+
+# Template tags that can't output links by themselves.
+_STATIC_TEMPLATE_TAGS = frozenset([
+    'if', 'elif', 'else', 'endif', 'for', 'empty', 'endfor', 'with', 'endwith',
+    'comment', 'endcomment', 'spaceless', 'endspaceless', 'now',
+    'resetcycle', 'ifchanged', 'endifchanged', 'regroup',
+    'block', 'endblock', 'verbatim', 'endverbatim', 'templatetag',
+    'widthratio', 'lorem', 'url', 'csrf_token',
+])
+
+_TEMPLATE_TAG_RE = re.compile(r'{%\s*(\w+)')
+
+# Template tags that load other templates, which can't be compiled from a
+# rewritten source: relative names need the origin of the template.
+_LOADING_TEMPLATE_TAGS = frozenset(['extends', 'include'])
+
+
+def _rewrite_links(html, replace):
+    """
+    Call replace(prefix, value, quote) for each link attribute of the tags
+    of the given HTML and substitute the attribute with its return value.
+    """
+    def replace_attribute(match):
+        if match.group('name').lower() not in _LINK_ATTRIBUTE_NAMES:
+            return match.group(0)
+        for group, quote in (('dq', '"'), ('sq', "'"), ('uq', '')):
+            value = match.group(group)
+            if value is not None:
+                return replace(match.group('prefix'), value, quote)
+
+    def replace_tag(match):
+        return _ATTRIBUTE_RE.sub(replace_attribute, match.group(0))
+    return _TAG_RE.sub(replace_tag, html)
+
+
+_ABSOLUTE_URL_RE = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*:')
+
+
+def _url_joiner(base_url):
+    """
+    Return a function equivalent to urljoin(base_url, url), that skips
+    urljoin() in the common cases of absolute URLs and of root-relative URLs
+    with no dot segments.
+    """
+    scheme, netloc = urlsplit(base_url)[:2]
+    origin = '%s://%s' % (scheme, netloc)
+
+    def join(url):
+        url = url.strip()
+        if _ABSOLUTE_URL_RE.match(url):
+            return url
+        if url.startswith('/') and not url.startswith('//') and '/.' not in url:
+            return origin + url
+        return urljoin(base_url, url)
+    return join
 
 
 def _make_links_absolute(html, base_url):
     """
     Make all links absolute in the given HTML (relative to the given base_url).
+    Link attributes are rewritten in place with a regular expression instead
+    of parsing the whole document, so the rest of the HTML is left untouched.
     """
-    from lxml.html import fromstring, tostring
-    parsed = fromstring(html)
+    join = _url_joiner(base_url)
 
-    parsed.make_links_absolute(base_url)
+    def absolute(prefix, value, quote):
+        return '%s%s%s%s' % (prefix, quote, join(value), quote)
+    return _rewrite_links(html, absolute)
 
-    return tostring(parsed, encoding='unicode')
+
+def _make_template_links_absolute(source, base_url):
+    """
+    Make the static links of a template source absolute.
+    Return a tuple (source, dynamic) where dynamic is True if the rendered
+    template may still contain relative links: when it outputs variables
+    (which may be safe HTML, even through attribute lookups), when some
+    links are made of template tags, when templates are included or extended
+    or when non-builtin tags are used.
+    """
+    dynamic = [False]
+    join = _url_joiner(base_url)
+
+    def absolute(prefix, value, quote):
+        if '{{' in value or '{%' in value:
+            dynamic[0] = True
+            return '%s%s%s%s' % (prefix, quote, value, quote)
+        return '%s%s%s%s' % (prefix, quote, join(value), quote)
+
+    source = _rewrite_links(source, absolute)
+    if '{{' in source:
+        dynamic[0] = True
+    if any(tag not in _STATIC_TEMPLATE_TAGS for tag in _TEMPLATE_TAG_RE.findall(source)):
+        dynamic[0] = True
+    return source, dynamic[0]
 
 
 class HtmlEmailTemplate(EmailTemplate):
-    """An HTML-only email template."""
+    """
+    An HTML-only email template.
+    
+    When rendering with make_links_absolute=True, the static links of the
+    body template are made absolute once, when the template is compiled for
+    a given site. The rendered body is only rewritten again when the template
+    may output links that weren't known at that time (see
+    _make_template_links_absolute). Templates that extend or include other
+    templates, or that don't use the django template engine, are rendered
+    as usual and their output is rewritten.
+    """
 
     def render(self, context=None, request=None, make_links_absolute=False):
-        email = super(HtmlEmailTemplate, self).render(context, request=request)
-        email.content_subtype = 'html'
+        if context is None:
+            context = {}
+
+        if not make_links_absolute:
+            return super(HtmlEmailTemplate, self).render(context, request=request)
 
-        if make_links_absolute:
-            assert request is not None
-            site = get_current_site(request)
+        assert request is not None
+        site = context['site'] = get_current_site(request)
+        self._links_base_url = 'https://' + site.domain
+        self._links_made_absolute = False
+        try:
+            # The site is already in the context, no need to pass the request.
+            email = super(HtmlEmailTemplate, self).render(context)
+        finally:
+            self._links_base_url = None
+
+        if not self._links_made_absolute: # render_body() was overridden
             email.body = _make_links_absolute(email.body, base_url='https://' + site.domain)
 
         return email
+
+    def _make_message(self, context, kwargs):
+        email = super(HtmlEmailTemplate, self)._make_message(context, kwargs)
+        email.content_subtype = 'html'
+        return email
+
+    def render_body(self, context):
+        base_url = getattr(self, '_links_base_url', None)
+        if base_url is None:
+            return super(HtmlEmailTemplate, self).render_body(context)
+
+        template, dynamic = self._get_absolute_links_body_template(base_url)
+        if template is None:
+            body = super(HtmlEmailTemplate, self).render_body(context)
+            dynamic = body is not None
+        else:
+            body = template.render(context)
+        if dynamic:
+            body = _make_links_absolute(body, base_url)
+
+        self._links_made_absolute = True
+        return body
+
+    def _get_absolute_links_body_template(self, base_url):
+        """
+        Return a tuple (template, dynamic) where template is the compiled
+        body template with its static links made absolute (or None if the
+        body can't be rewritten as a template) and dynamic says if the rendered
+        body still needs its links to be made absolute.
+        """
+        template_name = getattr(self, 'body_template_name', None)
+        template = getattr(self, 'body_template', None)
+        if template_name is None and template is None:
+            return None, True
+
+        cache = self._get_template_cache()
+        key = ('body', base_url)
+        source = (template_name, template)
+        cached = cache.get(key)
+        if cached is not None and cached[0] == source:
+            return cached[1]
+
+        if template_name is not None:
+            backend_template = get_template(template_name)
+            if isinstance(backend_template, DjangoTemplate):
+                text = backend_template.template.source
+            else:
+                text = None
+        elif not isinstance(template, str):
+            text = "\n".join(template)
+        else:
+            text = template
+
+        if text is None or _LOADING_TEMPLATE_TAGS.intersection(_TEMPLATE_TAG_RE.findall(text)):
+            compiled = (None, True)
+        else:
+            text, dynamic = _make_template_links_absolute(text, base_url)
+            compiled = (engines['django'].from_string(text), dynamic)
+        cache[key] = (source, compiled)
+        return compiled
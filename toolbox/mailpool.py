@@ -0,0 +1,153 @@
+from collections import deque
+import os
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.test.signals import setting_changed
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of open email backend connections, so that sending a
+    message doesn't pay for the connection, TLS and authentication setup.
+
+    At most size connections are open at once: threads wait for one to be
+    released when they're all in use. Connections idle for more than
+    idle_timeout seconds are closed rather than reused (servers drop them
+    anyway). SMTP connections idle for more than health_check_after seconds
+    are checked with a NOOP before being reused, while those released just
+    before aren't worth a round trip. A message whose connection turns out to
+    be dropped by the server is sent again once, over a checked connection.
+    """
+    def __init__(self, size=None, idle_timeout=None, health_check_after=None, backend=None,
+                 **backend_options):
+        if size is None:
+            size = getattr(settings, 'TOOLBOX_EMAIL_POOL_SIZE', 4)
+        if idle_timeout is None:
+            idle_timeout = getattr(settings, 'TOOLBOX_EMAIL_POOL_IDLE_TIMEOUT', 60)
+        if health_check_after is None:
+            health_check_after = getattr(settings, 'TOOLBOX_EMAIL_POOL_HEALTH_CHECK_AFTER', 1)
+
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.backend = backend
+        self.backend_options = backend_options
+        self.pid = os.getpid()
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        # Tuples (connection, release time), the most recently used last.
+        self._idle = deque()
+
+    def _is_healthy(self, connection):
+        smtp = getattr(connection, 'connection', None)
+        if smtp is None:
+            # Not an SMTP backend, or closed: open() will (re)connect.
+            return True
+        try:
+            return smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def acquire(self, check=False):
+        """
+        Return an open connection, which must be given back with release().
+        If check is True, reused connections are all checked.
+        """
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    connection, released = self._idle.pop()
+                idle = time.monotonic() - released
+                if idle <= self.idle_timeout and ((idle < self.health_check_after and not check)
+                                                  or self._is_healthy(connection)):
+                    connection.open()
+                    return connection
+                self._close(connection)
+
+            connection = get_connection(self.backend, **self.backend_options)
+            connection.open()
+            return connection
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, connection, broken=False):
+        """Give back a connection returned by acquire()."""
+        try:
+            if broken:
+                self._close(connection)
+            else:
+                with self._lock:
+                    self._idle.append((connection, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def send_messages(self, messages):
+        """
+        Send the given messages over a pooled connection and return the
+        number of messages sent, like a backend's send_messages().
+        """
+        for attempt in (1, 2):
+            # The other idle connections may have been dropped as well.
+            connection = self.acquire(check=attempt == 2)
+            try:
+                sent = connection.send_messages(messages)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self.release(connection, broken=True)
+                if attempt == 2:
+                    raise
+            except Exception:
+                self.release(connection, broken=True)
+                raise
+            else:
+                self.release(connection)
+                return sent
+
+    def close(self):
+        """Close the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for connection, released in idle:
+            self._close(connection)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the connection pool of the current process."""
+    global _pool
+    pool = _pool
+    if pool is None or pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                # Connections inherited from a parent process can't be shared.
+                _pool = ConnectionPool()
+            pool = _pool
+    return pool
+
+
+def _reset_pool(setting, **kwargs):
+    global _pool
+    if setting.startswith('EMAIL_') or setting.startswith('TOOLBOX_EMAIL_POOL_'):
+        with _pool_lock:
+            if _pool is not None:
+                _pool.close()
+            _pool = None
+
+setting_changed.connect(_reset_pool)
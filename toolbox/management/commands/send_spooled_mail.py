@@ -0,0 +1,54 @@
+import threading
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from toolbox.spool import get_spool
+
+
+class Command(BaseCommand):
+    help = "Send the email messages queued in the email spool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4,
+                            help="Number of worker threads.")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to wait when there's nothing to send.")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once there are no due messages left.")
+
+    def handle(self, **options):
+        spool = get_spool()
+        recovered = spool.recover()
+        if recovered:
+            self.stdout.write("Recovered %d stale message(s)." % recovered)
+
+        stop = threading.Event()
+        workers = [
+            threading.Thread(target=self.work, args=(spool, stop, options))
+            for i in range(options['threads'])
+        ]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            while any(worker.is_alive() for worker in workers):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+    def work(self, spool, stop, options):
+        """Deliver messages over a single connection until stopped."""
+        connection = get_connection()
+        try:
+            while not stop.is_set():
+                if not spool.deliver(connection):
+                    connection.close()
+                    if options['once']:
+                        return
+                    stop.wait(options['poll_interval'])
+        finally:
+            connection.close()
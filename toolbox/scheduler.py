@@ -0,0 +1,207 @@
+from collections import OrderedDict, deque, namedtuple
+import threading
+import time
+
+from django.core.mail import get_connection
+
+
+# Delivery statistics of a domain, as returned by DomainScheduler.run().
+# elapsed is the time between the first send and the end of the last one,
+# rate the number of messages sent per second over that time.
+DomainStats = namedtuple('DomainStats', 'sent failed elapsed rate')
+
+
+class TokenBucket(object):
+    """
+    Allow rate events per second on average, and bursts of up to burst
+    events.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Return the number of seconds to wait before a token is available."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Domain(object):
+    def __init__(self, name, rate, burst, concurrency):
+        self.name = name
+        self.messages = deque()
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.concurrency = concurrency
+        self.active = 0
+        self.sent = 0
+        self.failed = 0
+        self.started = None
+        self.finished = None
+
+    def delay(self, now):
+        """
+        Return the number of seconds before a message can be sent to this
+        domain, or None if it must wait for one of its sends to finish.
+        """
+        if self.active >= self.concurrency:
+            return None
+        if self.bucket is None:
+            return 0
+        return self.bucket.delay(now)
+
+    def stats(self):
+        elapsed = (self.finished - self.started) if self.started is not None else 0
+        return DomainStats(self.sent, self.failed, elapsed,
+                           self.sent / elapsed if elapsed else 0)
+
+
+class DomainScheduler(object):
+    """
+    Send email messages grouped by recipient domain, so that big providers
+    that throttle senders don't stall the whole batch.
+
+    Each domain gets a token bucket allowing rate messages per second (with
+    bursts of burst messages), and at most concurrency messages are sent to
+    it at once. limits can override these for some domains, as a dict of
+    domain: {'rate': ..., 'burst': ..., 'concurrency': ...}.
+    Messages are sent by threads worker threads, each with its own backend
+    connection, taking messages from the domains in turn: a domain that has
+    to wait is skipped until it is ready again.
+
+    A message is scheduled with the domain of its first recipient, so bulk
+    messages should have a single one.
+    """
+    def __init__(self, rate=None, burst=None, concurrency=2, threads=8, limits=None,
+                 connection_factory=get_connection):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.threads = threads
+        self.limits = limits or {}
+        self.connection_factory = connection_factory
+
+        self.domains = OrderedDict()
+        # Domains with messages left, in the order they get their turn.
+        self._turns = deque()
+        self._condition = threading.Condition()
+        # Tuples (message, exception) of the messages that couldn't be sent.
+        self.failures = []
+
+    def _get_domain(self, name):
+        try:
+            return self.domains[name]
+        except KeyError:
+            limits = self.limits.get(name, {})
+            domain = self.domains[name] = _Domain(
+                name,
+                limits.get('rate', self.rate),
+                limits.get('burst', self.burst),
+                limits.get('concurrency', self.concurrency),
+            )
+            return domain
+
+    def add(self, message):
+        """Schedule a message to be sent by run()."""
+        recipients = message.recipients()
+        name = recipients[0].rpartition('@')[2].rstrip('>').lower() if recipients else ''
+        with self._condition:
+            domain = self._get_domain(name)
+            if not domain.messages:
+                self._turns.append(domain)
+            domain.messages.append(message)
+            self._condition.notify()
+
+    def run(self):
+        """
+        Send all the scheduled messages and return a dict of DomainStats by
+        domain.
+        """
+        workers = [threading.Thread(target=self._work) for i in range(self.threads)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return self.stats()
+
+    def stats(self):
+        with self._condition:
+            return OrderedDict((name, domain.stats()) for name, domain in self.domains.items())
+
+    def _next(self):
+        """
+        Wait for a domain to be ready and return it with its next message,
+        or None once everything has been sent.
+        """
+        with self._condition:
+            while True:
+                if not self._turns:
+                    if not any(domain.active for domain in self.domains.values()):
+                        return None
+                    self._condition.wait()
+                    continue
+
+                now = time.monotonic()
+                wait = None
+                for i in range(len(self._turns)):
+                    domain = self._turns[0]
+                    self._turns.rotate(-1)
+                    delay = domain.delay(now)
+                    if delay == 0:
+                        message = domain.messages.popleft()
+                        if not domain.messages:
+                            self._turns.remove(domain)
+                        if domain.bucket is not None:
+                            domain.bucket.take(now)
+                        domain.active += 1
+                        if domain.started is None:
+                            domain.started = now
+                        return domain, message
+                    if delay is not None and (wait is None or delay < wait):
+                        wait = delay
+                # No domain is ready: wait for the first token or for a send
+                # to finish.
+                self._condition.wait(wait)
+
+    def _done(self, domain, message, error):
+        with self._condition:
+            domain.active -= 1
+            domain.finished = time.monotonic()
+            if error is None:
+                domain.sent += 1
+            else:
+                domain.failed += 1
+                self.failures.append((message, error))
+            self._condition.notify_all()
+
+    def _work(self):
+        connection = self.connection_factory()
+        try:
+            while True:
+                item = self._next()
+                if item is None:
+                    return
+                domain, message = item
+                try:
+                    # Keep the connection open between messages.
+                    connection.open()
+                    connection.send_messages([message])
+                except Exception as e:
+                    connection.close()
+                    self._done(domain, message, e)
+                else:
+                    self._done(domain, message, None)
+        finally:
+            connection.close()
@@ -0,0 +1,189 @@
+from collections import deque
+import os
+import pickle
+import time
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+class EmailSpool(object):
+    """
+    A durable queue of email messages, stored as files in a local directory.
+
+    The directory is laid out like a maildir:
+        * tmp/ holds messages being written,
+        * new/ holds messages waiting to be sent,
+        * cur/ holds messages claimed by a worker,
+        * dead/ holds messages that couldn't be sent after max_attempts.
+    Files are moved from one directory to another with atomic renames, so
+    a message is never seen half written and is claimed by a single worker.
+
+    File names start with the time before which the message must not be
+    sent, so that failed messages can be retried later with an exponential
+    backoff (backoff seconds, doubled after each attempt).
+    Messages are pickled: the spool directory must only be writable by
+    trusted processes.
+    """
+    max_attempts = 5
+    backoff = 60
+    # Claimed messages that are still there after this many seconds
+    # belong to a dead worker and are put back in the queue by recover().
+    stale_timeout = 3600
+    fsync = True
+
+    def __init__(self, path=None):
+        if path is None:
+            path = getattr(settings, 'TOOLBOX_EMAIL_SPOOL_DIR', None)
+        if not path:
+            raise ImproperlyConfigured("Set TOOLBOX_EMAIL_SPOOL_DIR to use the email spool.")
+
+        self.path = path
+        # Names of due messages listed by claim(), to be claimed in turn
+        # before listing the directory again.
+        self._due = deque()
+        for directory in ('tmp', 'new', 'cur', 'dead'):
+            try:
+                os.makedirs(os.path.join(path, directory))
+            except OSError:
+                if not os.path.isdir(os.path.join(path, directory)):
+                    raise
+
+    def _path(self, directory, name):
+        return os.path.join(self.path, directory, name)
+
+    def put(self, message, attempts=0, not_before=None):
+        """Add a message to the spool and return its name."""
+        if not_before is None:
+            not_before = time.time()
+        name = '%015d-%d-%s' % (not_before * 1000, attempts, uuid.uuid4().hex)
+
+        tmp_path = self._path('tmp', name)
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(message, f, pickle.HIGHEST_PROTOCOL)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.rename(tmp_path, self._path('new', name))
+        return name
+
+    def claim(self):
+        """
+        Claim the next message that is due and return a tuple
+        (name, message, attempts), or None if there are none.
+        
+        The new/ directory is only listed when the previously listed due
+        messages have all been claimed, so draining a large spool doesn't
+        list it again for each message.
+        Messages that can't be unpickled are moved to the dead letters.
+        """
+        while True:
+            try:
+                name = self._due.popleft()
+            except IndexError:
+                if not self._list_due():
+                    return None
+                continue
+
+            try:
+                os.rename(self._path('new', name), self._path('cur', name))
+            except OSError: # Claimed by another worker
+                continue
+            os.utime(self._path('cur', name), None)
+
+            try:
+                with open(self._path('cur', name), 'rb') as f:
+                    message = pickle.load(f)
+            except Exception:
+                os.rename(self._path('cur', name), self._path('dead', name))
+                continue
+            attempts = int(name.split('-')[1])
+            return name, message, attempts
+
+    def _list_due(self):
+        """
+        Queue the names of the messages that are due, in order, and return
+        whether there are any.
+        """
+        now = time.time() * 1000
+        due = []
+        for name in sorted(os.listdir(os.path.join(self.path, 'new'))):
+            if int(name.split('-')[0]) > now:
+                break
+            due.append(name)
+        self._due.extend(due)
+        return bool(due)
+
+    def ack(self, name):
+        """Remove a claimed message once it's been sent."""
+        os.remove(self._path('cur', name))
+
+    def retry(self, name, message, attempts):
+        """
+        Put a claimed message that couldn't be sent back in the queue, or in
+        the dead letters if it's been tried max_attempts times already.
+        """
+        attempts += 1
+        if attempts >= self.max_attempts:
+            os.rename(self._path('cur', name), self._path('dead', name))
+            return
+
+        not_before = time.time() + self.backoff * 2 ** (attempts - 1)
+        self.put(message, attempts, not_before)
+        os.remove(self._path('cur', name))
+
+    def recover(self):
+        """
+        Put messages claimed by workers that died back in the queue.
+        Return the number of recovered messages.
+        """
+        recovered = 0
+        limit = time.time() - self.stale_timeout
+        for name in os.listdir(os.path.join(self.path, 'cur')):
+            path = self._path('cur', name)
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.rename(path, self._path('new', name))
+                    recovered += 1
+            except OSError: # Acked or recovered by another process meanwhile
+                continue
+        return recovered
+
+    def deliver(self, connection):
+        """
+        Send the next due message with the given email backend connection.
+        Return False if there was no message to send, True otherwise.
+        """
+        claimed = self.claim()
+        if claimed is None:
+            return False
+
+        name, message, attempts = claimed
+        try:
+            connection.send_messages([message])
+        except Exception:
+            self.retry(name, message, attempts)
+            # The connection may have been dropped by the server: close it
+            # so that the next message is sent over a new one.
+            try:
+                connection.close()
+            except Exception:
+                pass
+        else:
+            self.ack(name)
+        return True
+
+
+_default_spools = {}
+
+
+def get_spool(path=None):
+    """Return a (cached) EmailSpool for the given path or the default one."""
+    if path is None:
+        path = getattr(settings, 'TOOLBOX_EMAIL_SPOOL_DIR', None)
+    try:
+        return _default_spools[path]
+    except KeyError:
+        spool = _default_spools[path] = EmailSpool(path)
+        return spool
@@ -14,33 +14,63 @@ def cloud_total(parser, token):
     """
     return CloudTotalNode(*cloud_common_parse(parser, token))
 
+@register.tag
+def cloud_pivot(parser, token):
+    """A wrapper around DataPointsCloud.pivot.
+    {% cloud_pivot cloud rows="month" cols="region" k1=v1 ... as table %}
+    """
+    cloud, keyvalues, var_name = cloud_common_parse(parser, token)
+    keys = set(key for key, value, is_literal in keyvalues)
+    if not set(['rows', 'cols']).issubset(keys) or var_name is None:
+        raise template.TemplateSyntaxError(
+            "%r tag requires rows=..., cols=... and as name arguments."
+            % token.split_contents()[0])
+    return CloudPivotNode(cloud, keyvalues, var_name)
+
 
 class BaseCloudFilterNode(template.Node):
+    """Base node for the cloud tags.
+    Results are memoized in the render context for the whole rendering of
+    the template, so that repeating a tag with the same arguments (in both
+    the header and the footer of a table for example) doesn't query the cloud
+    again, unless its version changed in between.
+    """
+    render_context_key = 'toolbox.templatetags.claude'
+    
     def __init__(self, cloud, keyvalues, var_name):
         self.cloud = template.Variable(cloud)
         self.keyvalues = keyvalues
         self.var_name = var_name
     
-    def _normalize(self, arg, context):
-        if arg[0] in ('"', "'") and arg[0] == arg[-1]:
-            return arg[1:-1]
-        return template.Variable(arg).resolve(context)
-    
     def _keyvalues(self, context):
-        for key, value in self.keyvalues:
-            yield str(key), self._normalize(value, context)
+        for key, value, is_literal in self.keyvalues:
+            yield key, value if is_literal else value.resolve(context)
     
     def render(self, context):
         cloud = self.cloud.resolve(context)
         keyvalues = dict(self._keyvalues(context))
         
-        value = self.cloud_proxy(cloud, keyvalues)
+        value = self._memoized_cloud_proxy(context, cloud, keyvalues)
         if self.var_name is None:
             return value
         
         context[self.var_name] = value
         return ''
     
+    def _memoized_cloud_proxy(self, context, cloud, keyvalues):
+        memo = context.render_context.setdefault(self.render_context_key, {})
+        try:
+            key = (self.__class__, id(cloud), getattr(cloud, 'version', None),
+                   frozenset(keyvalues.items()))
+            # The cloud is kept in the memo so that its id can't be reused.
+            return memo[key][1]
+        except TypeError: # Unhashable argument
+            return self.cloud_proxy(cloud, keyvalues)
+        except KeyError:
+            value = self.cloud_proxy(cloud, dict(keyvalues))
+            memo[key] = (cloud, value)
+            return value
+    
     def cloud_proxy(self, cloud, keyvalues):
         raise NotImplementedError
 
@@ -52,6 +82,12 @@ class CloudTotalNode(BaseCloudFilterNode):
     def cloud_proxy(self, cloud, keyvalues):
         return cloud.sum_(**keyvalues)
 
+class CloudPivotNode(BaseCloudFilterNode):
+    def cloud_proxy(self, cloud, keyvalues):
+        rows = keyvalues.pop('rows')
+        cols = keyvalues.pop('cols')
+        return cloud.pivot(rows, cols, **keyvalues)
+
 def cloud_common_parse(parser, token):
     """{% tag_name cloud k1=v1 k2=v2 ... [as name] %}"""
     content = token.split_contents()
@@ -64,6 +100,22 @@ def cloud_common_parse(parser, token):
     
     cloud = content[1]
     
-    keyvalues = [bit.split('=') for bit in content[2:]]
+    keyvalues = []
+    for bit in content[2:]:
+        key, value = bit.split('=', 1)
+        keyvalues.append((str(key),) + _compile_argument(value))
     
     return cloud, keyvalues, var_name
+
+def _compile_argument(arg):
+    """Return a (value, is_literal) tuple for the given tag argument.
+    Literals are resolved at parse time, other arguments are compiled into
+    a template.Variable to be resolved at render time, like translated
+    literals (_("...")) since the language is only known then.
+    """
+    if arg[0] in ('"', "'") and arg[0] == arg[-1]:
+        return arg[1:-1], True
+    variable = template.Variable(arg)
+    if variable.literal is not None and not variable.translate:
+        return variable.literal, True
+    return variable, False